@@ -0,0 +1 @@
+from .recordingconverter import convert_recording, convert_recordings, open_recording
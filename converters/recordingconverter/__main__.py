@@ -0,0 +1,34 @@
+import os
+import argparse
+from .recordingconverter import convert_recordings, _extensions
+
+def main():
+    parser=argparse.ArgumentParser(
+        prog='python -m recordingconverter',
+        description='Stream recordings (mda dataset directories or MEArec folders) to mda, hdf5 or flat binary files with bounded memory'
+    )
+    parser.add_argument('inputs',nargs='+',help='input recording(s)')
+    parser.add_argument('--out',required=True,help='output file, or output directory when converting several inputs')
+    parser.add_argument('--format',choices=sorted(_extensions.keys()),default='mda')
+    parser.add_argument('--dtype',default=None,help='output data type (default: same as input)')
+    parser.add_argument('--max-memory-mb',type=float,default=256,help='memory ceiling per conversion for buffered chunks')
+    parser.add_argument('--num-workers',type=int,default=None,help='number of processes when converting several inputs')
+    args=parser.parse_args()
+
+    if len(args.inputs)==1:
+        outputs=[args.out]
+    else:
+        if not os.path.exists(args.out):
+            os.mkdir(args.out)
+        outputs=[
+            os.path.join(args.out,os.path.basename(os.path.normpath(input))+_extensions[args.format])
+            for input in args.inputs
+        ]
+    jobs=[
+        dict(input=input,output=output,format=args.format,dtype=args.dtype,max_memory=int(args.max_memory_mb*2**20))
+        for input,output in zip(args.inputs,outputs)
+    ]
+    convert_recordings(jobs,num_workers=args.num_workers)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,178 @@
+import os
+import json
+import queue
+import threading
+import multiprocessing
+import numpy as np
+import h5py
+
+import spikeinterface as si
+from spikeinterface.extractors.mdaextractors.mdaio import MdaWriter
+from readers import hdf5_chunk_shape
+
+_extensions={'mda':'.mda','hdf5':'.h5','bin':'.bin'}
+
+def convert_recording(input_extractor,output_path,*,format='mda',dtype=None,max_memory=256*2**20,queue_size=2,chunk_size=None):
+    '''Stream an InputExtractor to disk in mda, hdf5 or flat binary format.
+
+    Reading and writing overlap: a producer thread reads chunks with
+    iterChunks into a bounded queue while the calling thread writes them
+    out. Each chunk is converted once, into the output data type and the
+    memory layout of the output file, and written without further copies.
+    At most queue_size+2 converted chunks plus the chunk being read are in
+    memory at any time, and the chunk size is chosen so that this stays
+    within max_memory bytes.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The recording to convert
+    output_path: str
+        The output file
+    format: str
+        'mda' (a raw.mda file), 'hdf5' (a 2D chunked 'timeseries' dataset as
+        read by TimeseriesHdf5Reader) or 'bin' (interleaved samples, frame
+        after frame, with the dimensions in output_path+'.json')
+    dtype: str
+        The output data type (default: the data type of the recording)
+    max_memory: int
+        The memory ceiling for buffered chunks, in bytes
+    queue_size: int
+        The number of chunks that may wait between the reader and the writer
+    chunk_size: int
+        The number of frames per chunk (default: derived from max_memory)
+    '''
+    M=input_extractor.getNumChannels()
+    N=input_extractor.getNumFrames()
+    in_dtype=np.asarray(input_extractor.getRawTraces(start_frame=0,end_frame=min(1,N))).dtype
+    if dtype is None:
+        dtype=in_dtype
+    dtype=np.dtype(dtype)
+    if chunk_size is None:
+        bytes_per_frame=M*(dtype.itemsize*(queue_size+2)+in_dtype.itemsize)
+        chunk_size=max(1,int(max_memory//bytes_per_frame))
+    samplerate=float(input_extractor.getSamplingFrequency().rescale('Hz').magnitude)
+
+    if format=='mda':
+        writer=MdaWriter(output_path,dims=(M,N),dt=dtype)
+    elif format=='hdf5':
+        writer=_Hdf5Writer(output_path,num_channels=M,num_frames=N,dtype=dtype,samplerate=samplerate)
+    elif format=='bin':
+        writer=_BinaryWriter(output_path,num_channels=M,num_frames=N,dtype=dtype,samplerate=samplerate)
+    else:
+        raise Exception('Unsupported output format: {}'.format(format))
+    # the memory layout matching the file: mda and bin store frame after frame
+    order='C' if format=='hdf5' else 'F'
+
+    chunks=queue.Queue(maxsize=queue_size)
+    stop=threading.Event()
+    def put(item):
+        # give up if the writer has failed, instead of blocking forever
+        while not stop.is_set():
+            try:
+                chunks.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for traces,_,_ in input_extractor.iterChunks(chunk_size):
+                # materialize here so the disk read happens on this thread
+                if not put(np.array(traces,dtype=dtype,order=order)):
+                    return
+            put(None)
+        except BaseException as err:
+            put(err)
+    producer=threading.Thread(target=produce,daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk=chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk,BaseException):
+                raise chunk
+            writer.write(chunk)
+        writer.close()
+    except BaseException:
+        stop.set()
+        writer.abort()
+        raise
+    finally:
+        producer.join()
+
+def convert_recordings(jobs,*,num_workers=None):
+    '''Run several conversions in parallel worker processes.
+
+    Parameters
+    ----------
+    jobs: list of dict
+        Each job has keys 'input' (an InputExtractor, or a path accepted
+        by open_recording) and 'output' (the output path), plus any keyword
+        arguments of convert_recording.
+    num_workers: int
+        The number of processes (default: one per CPU, at most len(jobs))
+    '''
+    if num_workers is None:
+        num_workers=multiprocessing.cpu_count()
+    num_workers=max(1,min(num_workers,len(jobs)))
+    if num_workers==1:
+        for job in jobs:
+            _run_job(job)
+        return
+    with multiprocessing.Pool(num_workers) as pool:
+        pool.map(_run_job,jobs,chunksize=1)
+
+def open_recording(path,download=True):
+    '''Open an mda dataset directory (raw.mda, params.json, geom.csv) or a
+    MEArec recordings folder as an InputExtractor'''
+    if os.path.exists(os.path.join(path,'recordings.npy')):
+        return si.MEArecInputExtractor(recording_folder=path)
+    return si.MdaInputExtractor(dataset_directory=path,download=download)
+
+def _run_job(job):
+    job=dict(job)
+    input=job.pop('input')
+    output=job.pop('output')
+    if isinstance(input,str):
+        input=open_recording(input)
+    convert_recording(input,output,**job)
+    return output
+
+class _Hdf5Writer:
+    def __init__(self,path,*,num_channels,num_frames,dtype,samplerate):
+        self._path=path
+        self._f=h5py.File(path,'w')
+        self._f.attrs['num_channels']=num_channels
+        self._f.attrs['num_timepoints']=num_frames
+        self._f.attrs['samplerate']=samplerate
+        self._dataset=self._f.create_dataset('timeseries',shape=(num_channels,num_frames),dtype=dtype,chunks=hdf5_chunk_shape(num_channels,num_frames,dtype.itemsize))
+        self._num_written=0
+    def write(self,chunk):
+        self._dataset[:,self._num_written:self._num_written+chunk.shape[1]]=chunk
+        self._num_written+=chunk.shape[1]
+    def close(self):
+        self._f.close()
+    def abort(self):
+        self._f.close()
+
+class _BinaryWriter:
+    def __init__(self,path,*,num_channels,num_frames,dtype,samplerate):
+        self._path=path
+        self._f=open(path,'wb')
+        with open(path+'.json','w') as f:
+            json.dump(dict(
+                num_channels=num_channels,
+                num_frames=num_frames,
+                dtype=dtype.name,
+                samplerate=samplerate,
+                order='interleaved'
+            ),f,indent=4)
+    def write(self,chunk):
+        # frame after frame, channels interleaved
+        self._f.write(memoryview(np.ascontiguousarray(chunk.T)))
+    def close(self):
+        self._f.close()
+    def abort(self):
+        self._f.close()
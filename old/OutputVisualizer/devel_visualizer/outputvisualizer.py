@@ -154,32 +154,24 @@ def compute_autocorrelogram(times,*,max_dt_tp,bin_size_tp,max_samples=None):
     num_bins_left=int(max_dt_tp/bin_size_tp) # number of bins to the left of the origin
     L=len(times) # number of events
     times2=np.sort(times) # the sorted times
-    step=1 # This is the index step between an event and the next one to compare
     candidate_inds=np.arange(L) # These are the events we are going to consider
     if max_samples is not None:
         if len(candidate_inds)>max_samples:
             candidate_inds=np.random.choice(candidate_inds,size=max_samples,replace=False)
-    vals_list=[] # A list of all offsets we have accumulated
-    while True:
-        candidate_inds=candidate_inds[candidate_inds+step<L] # we only consider events that are within workable range
-        candidate_inds=candidate_inds[times2[candidate_inds+step]-times2[candidate_inds]<=max_dt_tp] # we only consider event-pairs that are within max_dt_tp apart
-        if len(candidate_inds)>0: # if we have some events to consider
-            vals=times2[candidate_inds+step]-times2[candidate_inds]
-            vals_list.append(vals) # add to the autocorrelogram
-            vals_list.append(-vals) # keep it symmetric
-        else:
-            break # no more to consider
-        step+=1
-    if len(vals_list)>0: # concatenate all the values
-        all_vals=np.concatenate(vals_list)
-    else:
-        all_vals=np.array([]);
+    # the events within max_dt_tp after each candidate, found by binary search
+    hi=np.searchsorted(times2,times2[candidate_inds]+max_dt_tp,side='right')
+    num_after=hi-candidate_inds-1
+    anchors=np.repeat(candidate_inds,num_after)
+    starts=np.cumsum(num_after)-num_after
+    partners=anchors+1+np.arange(len(anchors))-np.repeat(starts,num_after)
+    vals=times2[partners]-times2[anchors]
+    all_vals=np.concatenate([vals,-vals]) # keep it symmetric
     aa=np.arange(-num_bins_left,num_bins_left+1)*bin_size_tp
     all_vals=np.sign(all_vals)*(np.abs(all_vals)-bin_size_tp*0.00001) # a trick to make the histogram symmetric due to differences in rounding for positive and negative, i suppose
     bin_counts,bin_edges=np.histogram(all_vals,bins=aa)
     return (bin_counts,bin_edges)
 
-def compute_autocorrelograms(output_analyzer,*,units=None,max_dt_msec=50,bin_size_msec=2,max_samples=5000):
+def compute_autocorrelograms(output_analyzer,*,units=None,max_dt_msec=50,bin_size_msec=2,max_samples=None):
     samplerate=output_analyzer.sampleRate()
     if units is None:
         units=range(1,output_analyzer.getUnitCount()+1)
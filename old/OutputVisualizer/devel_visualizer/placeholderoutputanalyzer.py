@@ -64,15 +64,15 @@ class PlaceholderOutputAnalyzer:
         
     def _extract_clips(self,timeseries,*,times,clip_size):
         M=timeseries.shape[0]
+        N=timeseries.shape[1]
         T=clip_size
-        L=len(times)
         Tmid = int(np.floor((T + 1) / 2) - 1);
-        clips=np.zeros((M,T,L),dtype='float32')
-        for j in range(L):
-            t1=int(times[j]-Tmid)
-            t2=int(t1+clip_size)
-            clips[:,:,j]=timeseries[:,t1:t2]
-        return clips
+        # (L,T) frame indices of every clip; clips overlapping the edges are zero padded
+        inds=np.asarray(times).astype(int)[:,np.newaxis]-Tmid+np.arange(T)[np.newaxis,:]
+        valid=(inds>=0)&(inds<N)
+        clips=timeseries[:,np.clip(inds,0,N-1)].astype('float32')
+        clips[:,~valid]=0
+        return clips.transpose((0,2,1))
 
     #def _sample_spikes(timeseries,firings,max_spikes_per_unit=20,clip_size=100):
     #    M=timeseries.shape[0]
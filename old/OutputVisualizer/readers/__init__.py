@@ -1,2 +1,4 @@
 from .impl import TimeseriesMdaReader
-from .impl import TimeseriesHdf5Reader
\ No newline at end of file
+from .impl import TimeseriesHdf5Reader
+from .impl import writeTimeseriesHdf5
+from .impl import hdf5_chunk_shape
@@ -1,5 +1,8 @@
 import h5py
 import numpy as np
+import zlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from mountainlab_pytools import mdaio
 
 class TimeseriesMdaReader:
@@ -25,21 +28,62 @@ class TimeseriesMdaReader:
         return chunk[np.array(channels)-1,:]
 
 class TimeseriesHdf5Reader:
-    def __init__(self,path):
+    '''Reads timeseries stored in hdf5 in one of two layouts:
+
+    * a single 2D dataset 'timeseries' of shape (num_channels, num_timepoints),
+      chunked in both dimensions (see writeTimeseriesHdf5), or
+    * the legacy layout with one dataset per channel and time chunk
+      ('parts/channel-{m}/chunk-{c}', padded by 'padding' timepoints).
+
+    The file is opened once and kept open until close() is called.
+    Channels are numbered from 1.
+
+    With num_threads>1, getChunk fans the reads out to a thread pool, one
+    task per hdf5 chunk (or per legacy channel/chunk dataset), each writing
+    into its own slice of the output. h5py serializes its calls with a
+    global lock, so for gzip/shuffle compressed datasets the raw chunks are
+    fetched with read_direct_chunk and decompressed by zlib outside the
+    lock, which is where the time goes. getReadStats() reports the
+    throughput of the last read.
+    '''
+    def __init__(self,path,*,num_threads=1):
         self._hdf5_path=path
-        with h5py.File(self._hdf5_path,"r") as f:
+        self._num_threads=num_threads
+        self._executor=None
+        self._read_stats=None
+        self._file=h5py.File(self._hdf5_path,"r")
+        f=self._file
+        self._num_channels=int(f.attrs['num_channels'])
+        self._num_timepoints=int(f.attrs['num_timepoints'])
+        self._samplerate=f.attrs['samplerate']
+        if 'timeseries' in f:
+            self._dataset=f['timeseries']
+        else:
+            self._dataset=None
             self._num_chunks=f.attrs['num_chunks']
             self._chunk_size=f.attrs['chunk_size']
             self._padding=f.attrs['padding']
-            self._num_channels=f.attrs['num_channels']
-            self._num_timepoints=f.attrs['num_timepoints']
-            self._samplerate=f.attrs['samplerate']
     def numChannels(self):
         return self._num_channels
     def numTimepoints(self):
         return self._num_timepoints
     def sampleRate(self):
         return self._samplerate
+    def getReadStats(self):
+        '''Return the size, duration and throughput (MB/s) of the last getChunk'''
+        return self._read_stats
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor=None
+        if self._file is not None:
+            self._file.close()
+            self._file=None
+            self._dataset=None
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
     def getChunk(self,*,trange=None,channels=None):
         if not channels:
             channels=range(1,self._num_channels+1)
@@ -48,30 +92,168 @@ class TimeseriesHdf5Reader:
         t1=trange[0]
         t2=trange[1]
         if (t1<0) or (t2>self.numTimepoints()):
-            ret=np.zeros((len(channels),t2-t1))
+            ret=np.zeros((len(channels),t2-t1),dtype=self._dtype())
             t1a=np.maximum(t1,0)
             t2a=np.minimum(t2,self.numTimepoints())
             ret[:,t1a-(t1):t2a-(t1)]=self.getChunk(trange=[t1a,t2a],channels=channels)
             return ret
+        timer=time.time()
+        if self._dataset is not None:
+            if self._num_threads>1:
+                ret=self._read_hyperslab_parallel(t1,t2,channels)
+            else:
+                ret=self._read_hyperslab(t1,t2,channels)
+        else:
+            ret=self._read_legacy(t1,t2,channels)
+        elapsed=time.time()-timer
+        self._read_stats=dict(
+            num_bytes=ret.nbytes,
+            elapsed_sec=elapsed,
+            mb_per_sec=ret.nbytes/1e6/elapsed if elapsed>0 else float('inf'),
+            num_threads=self._num_threads
+        )
+        return ret
+    def _dtype(self):
+        if self._dataset is not None:
+            return self._dataset.dtype
+        return float
+    def _read_hyperslab(self,t1,t2,channels):
+        ret=np.empty((len(channels),t2-t1),dtype=self._dataset.dtype)
+        if t2<=t1:
+            return ret
+        inds=np.array(channels)-1
+        if np.all(np.diff(inds)==1):
+            # contiguous channels: a single hyperslab read straight into the output
+            self._dataset.read_direct(ret,source_sel=np.s_[inds[0]:inds[-1]+1,t1:t2])
         else:
-            c1=int(t1/self._chunk_size)
-            c2=int((t2-1)/self._chunk_size)
-            ret=np.zeros((len(channels),t2-t1))
-            with h5py.File(self._hdf5_path,"r") as f:
-                for cc in range(c1,c2+1):
-                    if cc==c1:
-                        t1a=t1
-                    else:
-                        t1a=self._chunk_size*cc
-                    if cc==c2:
-                        t2a=t2
-                    else:
-                        t2a=self._chunk_size*(cc+1)
-                    for ii in range(len(channels)):
-                        m=channels[ii]
-                        assert(cc>=0)
-                        assert(cc<self._num_chunks)
-                        str='parts/channel-{}/chunk-{}'.format(m,cc)
-                        offset=self._chunk_size*cc-self._padding
-                        ret[ii,t1a-t1:t2a-t1]=f[str][t1a-offset:t2a-offset]
+            # read the bounding hyperslab once, then pick out the channels
+            i1=inds.min()
+            i2=inds.max()+1
+            block=np.empty((i2-i1,t2-t1),dtype=self._dataset.dtype)
+            self._dataset.read_direct(block,source_sel=np.s_[i1:i2,t1:t2])
+            ret[:,:]=block[inds-i1,:]
+        return ret
+    def _read_hyperslab_parallel(self,t1,t2,channels):
+        dset=self._dataset
+        ret=np.empty((len(channels),t2-t1),dtype=dset.dtype)
+        if t2<=t1:
             return ret
+        inds=np.array(channels)-1
+        i1=inds.min()
+        i2=inds.max()+1
+        if np.all(np.diff(inds)==1):
+            block=ret
+        else:
+            block=np.empty((i2-i1,t2-t1),dtype=dset.dtype)
+        c0,c1=dset.chunks
+        def read_chunk(ci,ti):
+            # the intersection of this hdf5 chunk with the requested window
+            a1=max(i1,ci*c0)
+            a2=min(i2,(ci+1)*c0)
+            b1=max(t1,ti*c1)
+            b2=min(t2,(ti+1)*c1)
+            data=self._read_raw_chunk(ci*c0,ti*c1)
+            if data is None:
+                dset.read_direct(block,source_sel=np.s_[a1:a2,b1:b2],dest_sel=np.s_[a1-i1:a2-i1,b1-t1:b2-t1])
+            else:
+                block[a1-i1:a2-i1,b1-t1:b2-t1]=data[a1-ci*c0:a2-ci*c0,b1-ti*c1:b2-ti*c1]
+        self._run_parallel([
+            (read_chunk,ci,ti)
+            for ci in range(i1//c0,(i2-1)//c0+1)
+            for ti in range(t1//c1,(t2-1)//c1+1)
+        ])
+        if block is not ret:
+            ret[:,:]=block[inds-i1,:]
+        return ret
+    def _read_raw_chunk(self,i,t):
+        # Returns the decoded chunk at offset (i,t), or None if this chunk
+        # has to be read through the hdf5 filter pipeline instead
+        dset=self._dataset
+        if (dset.compression not in (None,'gzip')) or dset.fletcher32 or (dset.scaleoffset is not None):
+            return None
+        try:
+            filter_mask,raw=dset.id.read_direct_chunk((i,t))
+        except Exception:
+            # e.g. a chunk that was never written
+            return None
+        if filter_mask!=0:
+            return None
+        if dset.compression=='gzip':
+            raw=zlib.decompress(raw)
+        itemsize=dset.dtype.itemsize
+        if dset.shuffle:
+            raw=np.frombuffer(raw,dtype=np.uint8).reshape(itemsize,-1).T.tobytes()
+        return np.frombuffer(raw,dtype=dset.dtype).reshape(dset.chunks)
+    def _run_parallel(self,tasks):
+        if self._executor is None:
+            self._executor=ThreadPoolExecutor(max_workers=self._num_threads)
+        futures=[self._executor.submit(*task) for task in tasks]
+        for future in futures:
+            future.result()
+    def _read_legacy(self,t1,t2,channels):
+        c1=int(t1/self._chunk_size)
+        c2=int((t2-1)/self._chunk_size)
+        ret=np.zeros((len(channels),t2-t1))
+        f=self._file
+        def read_part(cc,ii,t1a,t2a):
+            m=channels[ii]
+            assert(cc>=0)
+            assert(cc<self._num_chunks)
+            str='parts/channel-{}/chunk-{}'.format(m,cc)
+            offset=self._chunk_size*cc-self._padding
+            ret[ii,t1a-t1:t2a-t1]=f[str][t1a-offset:t2a-offset]
+        tasks=[]
+        for cc in range(c1,c2+1):
+            if cc==c1:
+                t1a=t1
+            else:
+                t1a=self._chunk_size*cc
+            if cc==c2:
+                t2a=t2
+            else:
+                t2a=self._chunk_size*(cc+1)
+            for ii in range(len(channels)):
+                tasks.append((read_part,cc,ii,t1a,t2a))
+        if self._num_threads>1:
+            self._run_parallel(tasks)
+        else:
+            for task in tasks:
+                task[0](*task[1:])
+        return ret
+
+def hdf5_chunk_shape(num_channels,num_timepoints,itemsize):
+    '''Return the default hdf5 chunk shape of a (num_channels x
+    num_timepoints) timeseries dataset: up to 64 channels and ~256 KB per
+    chunk, so that a short window over many channels (viewing) and a short
+    window over neighbouring channels (snippets) both touch few chunks.'''
+    chunk_channels=int(np.minimum(num_channels,64))
+    chunk_timepoints=int(np.minimum(num_timepoints,np.maximum(1,2**18//(chunk_channels*itemsize))))
+    return (chunk_channels,chunk_timepoints)
+
+def writeTimeseriesHdf5(reader,path,*,dtype='float32',chunk_shape=None,compression=None,write_chunk_size=None):
+    '''Write a timeseries to hdf5 as a single 2D dataset 'timeseries' of shape
+    (num_channels, num_timepoints), readable by TimeseriesHdf5Reader.
+
+    The data is streamed from the reader (anything with numChannels,
+    numTimepoints, sampleRate and getChunk, e.g. TimeseriesMdaReader), so
+    memory use is bounded by write_chunk_size.
+
+    The default hdf5 chunk shape is hdf5_chunk_shape(): up to 64 channels
+    and ~256 KB per chunk.
+    '''
+    M=reader.numChannels()
+    N=reader.numTimepoints()
+    itemsize=np.dtype(dtype).itemsize
+    if chunk_shape is None:
+        chunk_shape=hdf5_chunk_shape(M,N,itemsize)
+    if write_chunk_size is None:
+        # a whole number of hdf5 chunks, ~64 MB per write
+        write_chunk_size=chunk_shape[1]*int(np.maximum(1,2**26//(M*chunk_shape[1]*itemsize)))
+    with h5py.File(path,"w") as f:
+        f.attrs['num_channels']=M
+        f.attrs['num_timepoints']=N
+        f.attrs['samplerate']=reader.sampleRate()
+        dset=f.create_dataset('timeseries',shape=(M,N),dtype=dtype,chunks=chunk_shape,compression=compression)
+        for t1 in range(0,N,write_chunk_size):
+            t2=int(np.minimum(t1+write_chunk_size,N))
+            dset[:,t1:t2]=reader.getChunk(trange=[t1,t2],channels=range(1,M+1))
@@ -15,7 +15,8 @@ setuptools.setup(
         'numpy',
         'quantities',
         'mountainlab_pytools',
-        'neo'
+        'neo',
+        'scipy'
     ],
     classifiers=(
         "Programming Language :: Python :: 3",
@@ -0,0 +1,143 @@
+from .InputExtractor import InputExtractor
+from .tools import channel_index
+from collections import OrderedDict
+import threading
+import numpy as np
+
+class CachedInputExtractor(InputExtractor):
+    '''An InputExtractor that wraps another one and keeps recently read data
+    in memory. The time axis is split into aligned blocks of block_size
+    frames (all channels); getRawTraces is assembled from cached blocks and
+    only the missing blocks are read from the wrapped extractor. The least
+    recently used blocks are evicted once the cache exceeds max_bytes.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The extractor to read from
+    block_size: int
+        The number of frames in each cached block
+    max_bytes: int
+        The memory budget of the cache in bytes
+    '''
+    def __init__(self, input_extractor, *, block_size=16384, max_bytes=256*2**20):
+        InputExtractor.__init__(self)
+        self._input_extractor=input_extractor
+        self._block_size=int(block_size)
+        self._max_bytes=int(max_bytes)
+        self._blocks=OrderedDict()
+        self._num_bytes=0
+        self._num_hits=0
+        self._num_misses=0
+        self._num_evictions=0
+        self._lock=threading.Lock()
+
+    def getNumChannels(self):
+        return self._input_extractor.getNumChannels()
+
+    def getNumFrames(self):
+        return self._input_extractor.getNumFrames()
+
+    def getSamplingFrequency(self):
+        return self._input_extractor.getSamplingFrequency()
+
+    def getChannelInfo(self, channel_id):
+        return self._input_extractor.getChannelInfo(channel_id)
+
+    def getFileIdentity(self):
+        return self._input_extractor.getFileIdentity()
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        if start_frame is None:
+            start_frame=0
+        # like the wrapped extractors, reads past the end are truncated
+        end_frame=self.getNumFrames() if end_frame is None else min(end_frame,self.getNumFrames())
+        index=channel_index(channel_ids,self.getNumChannels())
+        bs=self._block_size
+        if end_frame<=start_frame:
+            return self._input_extractor.getRawTraces(start_frame=start_frame,end_frame=start_frame,channel_ids=channel_ids)
+        b1=start_frame//bs
+        b2=(end_frame-1)//bs
+        blocks=self._getBlocks(b1,b2)
+        if b1==b2:
+            # within a single block we can return a (read-only) view
+            return blocks[0][index,start_frame-b1*bs:end_frame-b1*bs]
+        num_channels=len(range(self.getNumChannels())[index]) if isinstance(index,slice) else len(index)
+        ret=np.empty((num_channels,end_frame-start_frame),dtype=blocks[0].dtype)
+        for b,block in zip(range(b1,b2+1),blocks):
+            t1=max(start_frame,b*bs)
+            t2=min(end_frame,(b+1)*bs)
+            ret[:,t1-start_frame:t2-start_frame]=block[index,t1-b*bs:t2-b*bs]
+        return ret
+
+    def prefetch(self, start_frame, end_frame):
+        '''Make sure the blocks covering [start_frame, end_frame) are cached'''
+        start_frame=max(int(start_frame),0)
+        end_frame=min(int(end_frame),self.getNumFrames())
+        if end_frame>start_frame:
+            self._getBlocks(start_frame//self._block_size,(end_frame-1)//self._block_size)
+
+    def getCacheStats(self):
+        '''Return a dict with the number of cache hits, misses and evictions
+        (counted in blocks) as well as the current size of the cache'''
+        with self._lock:
+            return dict(
+                hits=self._num_hits,
+                misses=self._num_misses,
+                evictions=self._num_evictions,
+                num_blocks=len(self._blocks),
+                num_bytes=self._num_bytes,
+                max_bytes=self._max_bytes,
+                block_size=self._block_size
+            )
+
+    def clearCache(self):
+        with self._lock:
+            self._blocks.clear()
+            self._num_bytes=0
+
+    def _getBlocks(self, b1, b2):
+        # blocks past the end of the recording would be empty; never cache them
+        b2=min(b2,(self.getNumFrames()-1)//self._block_size)
+        found={}
+        missing=[]
+        with self._lock:
+            for b in range(b1,b2+1):
+                if b in self._blocks:
+                    self._blocks.move_to_end(b)
+                    found[b]=self._blocks[b]
+                    self._num_hits+=1
+                else:
+                    missing.append(b)
+                    self._num_misses+=1
+        # read each run of consecutive missing blocks with a single call
+        # (outside the lock so that other threads can use the cache meanwhile)
+        i=0
+        while i<len(missing):
+            j=i
+            while (j+1<len(missing)) and (missing[j+1]==missing[j]+1):
+                j+=1
+            found.update(self._readBlocks(missing[i],missing[j]))
+            i=j+1
+        return [found[b] for b in range(b1,b2+1)]
+
+    def _readBlocks(self, b1, b2):
+        bs=self._block_size
+        num_frames=self.getNumFrames()
+        traces=self._input_extractor.getRawTraces(start_frame=b1*bs,end_frame=min((b2+1)*bs,num_frames))
+        ret={}
+        with self._lock:
+            for b in range(b1,b2+1):
+                block=np.array(traces[:,(b-b1)*bs:(b-b1+1)*bs])
+                block.flags.writeable=False
+                ret[b]=block
+                if b in self._blocks:
+                    self._num_bytes-=self._blocks[b].nbytes
+                self._num_bytes+=block.nbytes
+                self._blocks[b]=block
+                self._blocks.move_to_end(b)
+            while (self._num_bytes>self._max_bytes) and (len(self._blocks)>0):
+                _,evicted=self._blocks.popitem(last=False)
+                self._num_bytes-=evicted.nbytes
+                self._num_evictions+=1
+        return ret
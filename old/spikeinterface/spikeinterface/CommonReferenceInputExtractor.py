@@ -0,0 +1,89 @@
+from .InputExtractor import InputExtractor
+import numpy as np
+
+class CommonReferenceInputExtractor(InputExtractor):
+    '''An InputExtractor that re-references another one lazily: at every
+    frame, the median (or mean) across a group of channels is subtracted
+    from each channel of the group.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The extractor to re-reference
+    reference: str
+        'median' or 'average'
+    groups: str or list of lists
+        'global' (all channels form one group), 'group' (channels are
+        grouped by the 'group' key of getChannelInfo) or an explicit list
+        of channel groups
+    dtype: str
+        The data type of the re-referenced traces
+    '''
+    def __init__(self, input_extractor, *, reference='median', groups='global', dtype='float32'):
+        InputExtractor.__init__(self)
+        if reference not in ('median','average'):
+            raise Exception('Invalid reference: {}'.format(reference))
+        self._input_extractor=input_extractor
+        self._reference=reference
+        self._dtype=np.dtype(dtype)
+        M=input_extractor.getNumChannels()
+        if isinstance(groups,str):
+            if groups=='global':
+                groups=[list(range(M))]
+            elif groups=='group':
+                channel_groups=[input_extractor.getChannelInfo(ch)['group'] for ch in range(M)]
+                groups=[[ch for ch in range(M) if channel_groups[ch]==g] for g in sorted(set(channel_groups))]
+            else:
+                raise Exception('Invalid groups: {}'.format(groups))
+        self._groups=[np.array(group,dtype=int) for group in groups]
+        self._channel_group=np.full(M,-1,dtype=int)
+        for g,group in enumerate(self._groups):
+            self._channel_group[group]=g
+        if np.any(self._channel_group<0):
+            raise Exception('Every channel must belong to a reference group')
+
+    def getNumChannels(self):
+        return self._input_extractor.getNumChannels()
+
+    def getNumFrames(self):
+        return self._input_extractor.getNumFrames()
+
+    def getSamplingFrequency(self):
+        return self._input_extractor.getSamplingFrequency()
+
+    def getChannelInfo(self, channel_id):
+        return self._input_extractor.getChannelInfo(channel_id)
+
+    def getFileIdentity(self):
+        input_identity=self._input_extractor.getFileIdentity()
+        if input_identity is None:
+            return None
+        return '{} reference={} groups={} dtype={}'.format(input_identity,self._reference,[group.tolist() for group in self._groups],self._dtype)
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        if start_frame is None:
+            start_frame=0
+        if end_frame is None:
+            end_frame=self.getNumFrames()
+        if channel_ids is None:
+            channel_ids=range(self.getNumChannels())
+        channel_ids=np.asarray(channel_ids,dtype=int)
+        groups=np.unique(self._channel_group[channel_ids])
+        # read every channel of the groups involved at once
+        needed=np.sort(np.concatenate([self._groups[g] for g in groups]))
+        traces=np.asarray(self._input_extractor.getRawTraces(start_frame=start_frame,end_frame=end_frame,channel_ids=needed),dtype=self._dtype)
+        row=np.zeros(self.getNumChannels(),dtype=int)
+        row[needed]=np.arange(len(needed))
+        if len(groups)==1:
+            return traces[row[channel_ids],:]-self._compute_reference(traces)
+        ret=np.empty((len(channel_ids),end_frame-start_frame),dtype=self._dtype)
+        for g in groups:
+            inds=np.flatnonzero(self._channel_group[channel_ids]==g)
+            ref=self._compute_reference(traces[row[self._groups[g]],:])
+            ret[inds,:]=traces[row[channel_ids[inds]],:]-ref
+        return ret
+
+    def _compute_reference(self, traces):
+        if self._reference=='median':
+            return np.median(traces,axis=0,keepdims=True)
+        return np.mean(traces,axis=0,keepdims=True)
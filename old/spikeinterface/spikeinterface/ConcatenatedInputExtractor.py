@@ -0,0 +1,194 @@
+from .InputExtractor import InputExtractor
+from .OutputExtractor import OutputExtractor
+import numpy as np
+
+class ConcatenatedInputExtractor(InputExtractor):
+    '''An InputExtractor that presents several recordings (segments) with
+    the same channels as one continuous timeline.
+
+    Segments may be given as extractors or as functions that open one, in
+    which case a segment is only opened when it is first read. If
+    num_frames is also given, constructing the extractor and asking for its
+    size does not open any segment at all.
+
+    Parameters
+    ----------
+    input_extractors: list
+        The segments, in order: InputExtractor objects or zero-argument
+        callables returning one
+    num_frames: list of int
+        The number of frames of each segment (default: asked from the
+        segments when first needed)
+    '''
+    def __init__(self, input_extractors, *, num_frames=None):
+        InputExtractor.__init__(self)
+        self._segments=list(input_extractors)
+        if len(self._segments)==0:
+            raise Exception('ConcatenatedInputExtractor needs at least one segment')
+        self._offsets=None
+        if num_frames is not None:
+            if len(num_frames)!=len(self._segments):
+                raise Exception('num_frames must have one entry per segment')
+            self._offsets=np.concatenate(([0],np.cumsum(num_frames))).astype(np.int64)
+
+    def getNumSegments(self):
+        return len(self._segments)
+
+    def getSegment(self, segment_index):
+        '''Return the InputExtractor of a segment, opening it if needed'''
+        segment=self._segments[segment_index]
+        if not isinstance(segment,InputExtractor):
+            segment=segment()
+            self._segments[segment_index]=segment
+        return segment
+
+    def getSegmentOffsets(self):
+        '''Return the first frame of every segment, followed by the total
+        number of frames'''
+        if self._offsets is None:
+            num_frames=[self.getSegment(i).getNumFrames() for i in range(len(self._segments))]
+            self._offsets=np.concatenate(([0],np.cumsum(num_frames))).astype(np.int64)
+        return self._offsets
+
+    def frameToSegment(self, frame):
+        '''Return the index of the segment containing frame, and the frame
+        within that segment (binary search over the segment offsets)'''
+        offsets=self.getSegmentOffsets()
+        i=int(np.searchsorted(offsets[1:],frame,side='right'))
+        return i,int(frame-offsets[i])
+
+    def getNumChannels(self):
+        return self.getSegment(0).getNumChannels()
+
+    def getNumFrames(self):
+        return int(self.getSegmentOffsets()[-1])
+
+    def getSamplingFrequency(self):
+        return self.getSegment(0).getSamplingFrequency()
+
+    def getChannelInfo(self, channel_id):
+        return self.getSegment(0).getChannelInfo(channel_id)
+
+    def getFileIdentity(self):
+        identities=[self.getSegment(i).getFileIdentity() for i in range(len(self._segments))]
+        if any(identity is None for identity in identities):
+            return None
+        return ' + '.join(identities)
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        if start_frame is None:
+            start_frame=0
+        # like the segments, reads past the end are truncated
+        end_frame=self.getNumFrames() if end_frame is None else min(end_frame,self.getNumFrames())
+        if end_frame<=start_frame:
+            return self.getSegment(0).getRawTraces(start_frame=0,end_frame=0,channel_ids=channel_ids)
+        offsets=self.getSegmentOffsets()
+        s1,_=self.frameToSegment(start_frame)
+        s2,_=self.frameToSegment(end_frame-1)
+        if s1==s2:
+            # within one segment: forward the read (and any view) unchanged
+            return self.getSegment(s1).getRawTraces(start_frame=start_frame-offsets[s1],end_frame=end_frame-offsets[s1],channel_ids=channel_ids)
+        ret=None
+        for s in range(s1,s2+1):
+            t1=max(start_frame,offsets[s])
+            t2=min(end_frame,offsets[s+1])
+            if t2<=t1:
+                continue
+            traces=self.getSegment(s).getRawTraces(start_frame=t1-offsets[s],end_frame=t2-offsets[s],channel_ids=channel_ids)
+            if ret is None:
+                ret=np.empty((traces.shape[0],end_frame-start_frame),dtype=traces.dtype)
+            ret[:,t1-start_frame:t2-start_frame]=traces
+        return ret
+
+class ConcatenatedOutputExtractor(OutputExtractor):
+    '''An OutputExtractor that concatenates the spike trains of several
+    segments, shifting each segment's spike frames by the segment's
+    offset. Unit ids are assumed to refer to the same units in every
+    segment.
+
+    Parameters
+    ----------
+    output_extractors: list
+        The segments, in order: OutputExtractor objects or zero-argument
+        callables returning one
+    segment_offsets: array_like
+        The first frame of every segment, e.g. from
+        ConcatenatedInputExtractor.getSegmentOffsets()
+    '''
+    def __init__(self, output_extractors, *, segment_offsets):
+        OutputExtractor.__init__(self)
+        self._segments=list(output_extractors)
+        self._offsets=np.asarray(segment_offsets,dtype=np.int64)[:len(self._segments)]
+        if len(self._offsets)!=len(self._segments):
+            raise Exception('segment_offsets must have one entry per segment')
+        self._num_units=None
+
+    def getSegment(self, segment_index):
+        segment=self._segments[segment_index]
+        if not isinstance(segment,OutputExtractor):
+            segment=segment()
+            self._segments[segment_index]=segment
+        return segment
+
+    def getNumUnits(self):
+        if self._num_units is None:
+            self._num_units=max(self.getSegment(i).getNumUnits() for i in range(len(self._segments)))
+        return self._num_units
+
+    def getUnitSpikeTrain(self, unit_id, start_frame=None, end_frame=None):
+        spike_trains=[]
+        for s in self._segmentsInRange(start_frame,end_frame):
+            segment=self.getSegment(s)
+            if unit_id>=segment.getNumUnits():
+                continue
+            st=segment.getUnitSpikeTrain(unit_id,*self._segmentRange(s,start_frame,end_frame))
+            spike_trains.append(np.asarray(st)+self._offsets[s])
+        if len(spike_trains)==0:
+            return np.zeros(0)
+        return np.concatenate(spike_trains)
+
+    def getAllSpikeTrains(self, start_frame=None, end_frame=None):
+        unit_index={unit:k for k,unit in enumerate(self.getUnitIds())}
+        all_frames=[]
+        all_labels=[]
+        for s in self._segmentsInRange(start_frame,end_frame):
+            segment=self.getSegment(s)
+            frames,labels,_=segment.getAllSpikeTrains(*self._segmentRange(s,start_frame,end_frame))
+            all_frames.append(np.asarray(frames)+self._offsets[s])
+            # labels are positions in the segment's unit ids; map them to
+            # positions in ours
+            positions=np.array([unit_index[unit] for unit in segment.getUnitIds()],dtype=np.int64)
+            all_labels.append(positions[np.asarray(labels,dtype=np.int64)])
+        if len(all_frames)==0:
+            return np.zeros(0),np.zeros(0,dtype=np.int64),np.zeros(self.getNumUnits()+1,dtype=np.int64)
+        spike_frames=np.concatenate(all_frames)
+        spike_labels=np.concatenate(all_labels)
+        # group by unit; the stable sort keeps segments (and so time) in order
+        order=np.argsort(spike_labels,kind='stable')
+        spike_frames=spike_frames[order]
+        spike_labels=spike_labels[order]
+        offsets=np.zeros(self.getNumUnits()+1,dtype=np.int64)
+        offsets[1:]=np.cumsum(np.bincount(spike_labels,minlength=self.getNumUnits()))
+        return spike_frames,spike_labels,offsets
+
+    def getFileIdentity(self):
+        identities=[self.getSegment(i).getFileIdentity() for i in range(len(self._segments))]
+        if any(identity is None for identity in identities):
+            return None
+        return ' + '.join('{}@{}'.format(identity,offset) for identity,offset in zip(identities,self._offsets))
+
+    def _segmentsInRange(self, start_frame, end_frame):
+        s1=0
+        s2=len(self._segments)
+        if start_frame is not None:
+            s1=max(int(np.searchsorted(self._offsets,start_frame,side='right'))-1,0)
+        if end_frame is not None:
+            s2=int(np.searchsorted(self._offsets,end_frame,side='left'))
+        return range(s1,s2)
+
+    def _segmentRange(self, s, start_frame, end_frame):
+        # the requested range in the segment's own frames
+        return (
+            None if start_frame is None else start_frame-self._offsets[s],
+            None if end_frame is None else end_frame-self._offsets[s]
+        )
@@ -0,0 +1,104 @@
+from .InputExtractor import InputExtractor
+from .CachedInputExtractor import CachedInputExtractor
+import numpy as np
+from scipy import signal
+
+class FilterInputExtractor(InputExtractor):
+    '''An InputExtractor that bandpass filters another one lazily, inside
+    getRawTraces, so filtered data never has to be stored.
+
+    The filter is a linear-phase FIR filter applied without delay, which
+    makes it zero-phase with a finite support of num_taps frames. Each
+    read is extended by (num_taps-1)/2 frames on both sides (zero filled
+    past the ends of the recording), so any window is exactly equal to the
+    same frames of the whole recording filtered at once. All requested
+    channels are filtered together with one FFT convolution.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The extractor to filter
+    freq_min: float
+        The low cutoff frequency in Hz
+    freq_max: float
+        The high cutoff frequency in Hz (None or >= Nyquist for a highpass)
+    num_taps: int
+        The filter length in frames (odd; default 4*fs/freq_min)
+    dtype: str
+        The data type of the filtered traces
+    cache_max_bytes: int
+        If given, filtered blocks are kept in a CachedInputExtractor with
+        this memory budget
+    cache_block_size: int
+        The block size (in frames) of the cache
+    '''
+    def __init__(self, input_extractor, *, freq_min=300, freq_max=6000, num_taps=None, dtype='float32', cache_max_bytes=None, cache_block_size=16384):
+        InputExtractor.__init__(self)
+        self._input_extractor=input_extractor
+        self._freq_min=freq_min
+        self._freq_max=freq_max
+        self._dtype=np.dtype(dtype)
+        fs=float(input_extractor.getSamplingFrequency().rescale('Hz').magnitude)
+        if num_taps is None:
+            num_taps=int(4*fs/freq_min)
+        num_taps=int(num_taps)|1
+        self._num_taps=num_taps
+        if (freq_max is None) or (freq_max>=fs/2):
+            self._kernel=signal.firwin(num_taps,freq_min,pass_zero=False,fs=fs)
+        else:
+            self._kernel=signal.firwin(num_taps,[freq_min,freq_max],pass_zero=False,fs=fs)
+        self._kernel=self._kernel.astype(self._dtype)
+        self._margin=(num_taps-1)//2
+        if cache_max_bytes is not None:
+            self._cache=CachedInputExtractor(
+                FilterInputExtractor(input_extractor,freq_min=freq_min,freq_max=freq_max,num_taps=num_taps,dtype=dtype),
+                block_size=cache_block_size,
+                max_bytes=cache_max_bytes
+            )
+        else:
+            self._cache=None
+
+    def getNumChannels(self):
+        return self._input_extractor.getNumChannels()
+
+    def getNumFrames(self):
+        return self._input_extractor.getNumFrames()
+
+    def getSamplingFrequency(self):
+        return self._input_extractor.getSamplingFrequency()
+
+    def getChannelInfo(self, channel_id):
+        return self._input_extractor.getChannelInfo(channel_id)
+
+    def getFileIdentity(self):
+        input_identity=self._input_extractor.getFileIdentity()
+        if input_identity is None:
+            return None
+        return '{} filter={}-{} taps={} dtype={}'.format(input_identity,self._freq_min,self._freq_max,self._num_taps,self._dtype)
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        if start_frame is None:
+            start_frame=0
+        if end_frame is None:
+            end_frame=self.getNumFrames()
+        if self._cache is not None:
+            return self._cache.getRawTraces(start_frame=start_frame,end_frame=end_frame,channel_ids=channel_ids)
+        if channel_ids is None:
+            channel_ids=range(self.getNumChannels())
+        if end_frame<=start_frame:
+            return np.zeros((len(channel_ids),0),dtype=self._dtype)
+        traces=self._input_extractor._getPaddedTraces(start_frame-self._margin,end_frame+self._margin,channel_ids)
+        return self.filterTraces(traces)
+
+    def filterTraces(self, traces):
+        '''Filter traces that include the margin of (num_taps-1)/2 frames on
+        both sides. The result is shorter by num_taps-1 frames.'''
+        traces=np.asarray(traces,dtype=self._dtype)
+        return signal.oaconvolve(traces,self._kernel[np.newaxis,:],mode='valid',axes=1).astype(self._dtype,copy=False)
+
+    def getMargin(self):
+        '''Return the number of frames needed on each side of a window'''
+        return self._margin
+
+    def getKernel(self):
+        return self._kernel.copy()
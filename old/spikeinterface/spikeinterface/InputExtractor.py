@@ -1,4 +1,7 @@
 from abc import ABC, abstractmethod
+import numpy as np
+from .channelstats import compute_channel_stats
+from .waveforms import _gather_snippets
 
 class InputExtractor(ABC):
     '''A class that contains functions for extracting important information
@@ -92,10 +95,16 @@ class InputExtractor(ABC):
         raise NotImplementedError("The timeToFrame function is not \
                                   implemented for this extractor")
 
-    def getRawSnippets(self, snippet_len, center_frames, channel_ids):
+    def getRawSnippets(self, snippet_len, center_frames, channel_ids=None):
         '''This function returns raw data snippets from the given channels that
         are centered on the given frames and are the length of the given snippet
-        length.
+        length. Snippets that extend past the start or end of the recording are
+        zero padded.
+
+        The default implementation sorts the snippets by frame, groups nearby
+        snippets into covering windows, reads each window once with
+        getRawTraces and gathers all of its snippets with a single strided
+        index.
 
         Parameters
         ----------
@@ -106,17 +115,106 @@ class InputExtractor(ABC):
             each snippet.
         channel_ids: array_like
             A list or array of channel ids (ints) from which each trace will be
-            extracted.
+            extracted. If None, all channels are used.
 
         Returns
         ----------
-        raw_snippets: array_like
+        raw_snippets: numpy.ndarray
             A 3D array that contains all of the raw snippets from each channel.
-            Dimensions are: (num_channels x num_snippets x snippet_len)
+            Dimensions are: (num_channels x snippet_len x num_snippets)
         '''
-        raise NotImplementedError("The getRawSnippets function is not \
-                                  implemented for this extractor")
+        if channel_ids is None:
+            channel_ids=range(self.getNumChannels())
+        # Start a new covering window when the next snippet is far from the
+        # previous one, or when the window would exceed ~4M samples
+        return _gather_snippets(self,center_frames,snippet_len,channel_ids,
+            chunk_size=2**22//max(len(channel_ids),1),max_gap=2*int(snippet_len))
+
+    def iterChunks(self, chunk_size, padding=0, channel_ids=None, dtype=None, reuse_buffer=False, start_frame=None, end_frame=None):
+        '''This function walks through the recording in consecutive chunks,
+        so that whole-recording computations can run in bounded memory. Each
+        chunk is extended by padding frames on both sides (overlapping its
+        neighbours); frames that fall outside the recording are zero filled.
+
+        Parameters
+        ----------
+        chunk_size: int
+            The number of frames in each chunk (excluding padding). The last
+            chunk may be shorter.
+        padding: int
+            The number of extra frames to include on each side of a chunk
+        channel_ids: array_like
+            A list or array of channel ids (ints) to read. If None, all
+            channels are read.
+        dtype: numpy.dtype
+            The data type of the yielded traces (default: as returned by
+            getRawTraces)
+        reuse_buffer: bool
+            If True, every chunk is written into the same preallocated buffer
+            and a view of it is yielded, so the traces are only valid until
+            the next iteration.
+        start_frame: int
+            The first frame to iterate over (default 0)
+        end_frame: int
+            The frame at which to stop iterating (default: end of recording)
 
+        Yields
+        ------
+        traces: numpy.ndarray
+            The traces of frames [chunk_start-padding, chunk_end+padding).
+            Dimensions are: (num_channels x (chunk_end-chunk_start+2*padding))
+        chunk_start: int
+            The first frame of the chunk, excluding padding
+        chunk_end: int
+            The end frame (exclusive) of the chunk, excluding padding
+        '''
+        if start_frame is None:
+            start_frame=0
+        if end_frame is None:
+            end_frame=self.getNumFrames()
+        if channel_ids is None:
+            channel_ids=range(self.getNumChannels())
+        chunk_size=int(chunk_size)
+        padding=int(padding)
+        buffer=None
+        for chunk_start in range(start_frame,end_frame,chunk_size):
+            chunk_end=min(chunk_start+chunk_size,end_frame)
+            width=chunk_end-chunk_start+2*padding
+            if buffer is not None:
+                traces=self._getPaddedTraces(chunk_start-padding,chunk_end+padding,channel_ids,out=buffer[:,:width])
+            else:
+                traces=self._getPaddedTraces(chunk_start-padding,chunk_end+padding,channel_ids)
+                if reuse_buffer:
+                    buffer=np.empty((len(channel_ids),chunk_size+2*padding),dtype=dtype if dtype is not None else traces.dtype)
+                    buffer[:,:width]=traces
+                    traces=buffer[:,:width]
+            if dtype is not None:
+                traces=traces.astype(dtype,copy=False)
+            yield traces,chunk_start,chunk_end
+
+    def _getPaddedTraces(self, start_frame, end_frame, channel_ids, out=None):
+        '''Like getRawTraces, but the frame range may extend past either end
+        of the recording, in which case the missing frames are zero filled.
+        If out is given, the traces are written into it.
+        '''
+        num_frames=self.getNumFrames()
+        t1=max(start_frame,0)
+        t2=min(end_frame,num_frames)
+        if (out is None) and (t1==start_frame) and (t2==end_frame):
+            return self.getRawTraces(start_frame=start_frame,end_frame=end_frame,channel_ids=channel_ids)
+        if t1>=t2:
+            traces=None
+        else:
+            traces=self.getRawTraces(start_frame=t1,end_frame=t2,channel_ids=channel_ids)
+        if out is None:
+            dtype=traces.dtype if traces is not None else float
+            out=np.zeros((len(channel_ids),end_frame-start_frame),dtype=dtype)
+        else:
+            out[:,:t1-start_frame]=0
+            out[:,max(t2,t1)-start_frame:]=0
+        if traces is not None:
+            out[:,t1-start_frame:t2-start_frame]=traces
+        return out
 
     def getChannelInfo(self, channel_id):
         '''This function returns the a dictionary containing information about
@@ -145,3 +243,41 @@ class InputExtractor(ABC):
         '''
         raise NotImplementedError("The getChannelInfo function is not \
                                   implemented for this extractor")
+
+    def getFileIdentity(self):
+        '''This function returns a string that identifies the data behind
+        the extractor, e.g. the path, size and modification time of the
+        underlying file, so that results computed from the traces can be
+        cached on disk. Extractors that cannot identify their data return
+        None (the default), in which case nothing is cached.
+
+        Returns
+        -------
+        identity: str or None
+            The identity of the data
+        '''
+        return None
+
+    def getChannelStats(self, *, num_chunks=20, chunk_size=10000, percentiles=(1,5,25,50,75,95,99), seed=0, num_workers=None, cache_directory=None):
+        '''This function returns per-channel statistics (mean, std, noise
+        level, min, max and percentiles) estimated from chunks sampled across
+        the whole recording. Results are kept on the extractor and, when
+        getFileIdentity is implemented, in a sidecar file on disk. See
+        spikeinterface.channelstats.compute_channel_stats for the parameters.
+
+        Returns
+        -------
+        stats: dict
+            mean, std, noise, min and max (arrays of length num_channels),
+            percentiles (num_channels x num_percentiles) and
+            percentile_levels
+        '''
+        key=(num_chunks,chunk_size,tuple(percentiles),seed)
+        if not hasattr(self,'_channel_stats'):
+            self._channel_stats={}
+        if key not in self._channel_stats:
+            self._channel_stats[key]=compute_channel_stats(
+                self,num_chunks=num_chunks,chunk_size=chunk_size,percentiles=percentiles,
+                seed=seed,num_workers=num_workers,cache_directory=cache_directory
+            )
+        return self._channel_stats[key]
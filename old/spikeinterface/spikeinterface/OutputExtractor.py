@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import numpy as np
 
 class OutputExtractor(ABC):
     '''A class that contains functions for extracting important information
@@ -52,3 +53,68 @@ class OutputExtractor(ABC):
             specified unit given the range of start and end frames.
         '''
         pass
+
+    def getUnitIds(self):
+        '''This function returns the ids of the units in the recording, in
+        the order used by getAllSpikeTrains.
+
+        Returns
+        ----------
+        unit_ids: list
+            A list of unit ids (ints)
+        '''
+        return list(range(self.getNumUnits()))
+
+    def getAllSpikeTrains(self, start_frame=None, end_frame=None):
+        '''This function extracts the spike frames of all units at once, in a
+        compact ragged representation: the spike trains of all units are
+        concatenated (in the order of getUnitIds) and an offsets array marks
+        where each unit's spikes start. The spikes of unit_ids[k] are
+        spike_frames[offsets[k]:offsets[k+1]].
+
+        The default implementation calls getUnitSpikeTrain for every unit;
+        extractors that hold all spikes in memory should override it.
+
+        Parameters
+        ----------
+        start_frame: int
+            The frame above which a spike frame is returned.
+        end_frame: int
+            The frame below which a spike frame is returned.
+        Returns
+        ----------
+        spike_frames: numpy.ndarray
+            A 1D array with the spike frames of all units, grouped by unit
+        spike_labels: numpy.ndarray
+            A 1D array with the position of each spike's unit in unit_ids
+            (0, 1, ...), which equals the unit id only when the ids are
+            0, 1, ...
+        offsets: numpy.ndarray
+            A 1D array of length num_units+1 with the start of each unit's
+            spikes in spike_frames
+        '''
+        unit_ids=self.getUnitIds()
+        spike_trains=[np.asarray(self.getUnitSpikeTrain(unit_id,start_frame,end_frame)) for unit_id in unit_ids]
+        counts=[len(spike_train) for spike_train in spike_trains]
+        offsets=np.zeros(len(unit_ids)+1,dtype=np.int64)
+        offsets[1:]=np.cumsum(counts)
+        if len(spike_trains)>0:
+            spike_frames=np.concatenate(spike_trains)
+        else:
+            spike_frames=np.zeros(0)
+        spike_labels=np.repeat(np.arange(len(unit_ids),dtype=np.int64),counts)
+        return spike_frames,spike_labels,offsets
+
+    def getFileIdentity(self):
+        '''This function returns a string that identifies the data behind
+        the extractor (e.g. the path, size and modification time of the
+        sorting output file), so that results computed from the spike trains
+        can be cached on disk. Extractors that cannot identify their data
+        return None (the default).
+
+        Returns
+        -------
+        identity: str or None
+            The identity of the data
+        '''
+        return None
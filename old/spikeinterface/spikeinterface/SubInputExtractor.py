@@ -0,0 +1,89 @@
+from .InputExtractor import InputExtractor
+import numpy as np
+
+class SubInputExtractor(InputExtractor):
+    '''A view of a subset of the channels and frames of another
+    InputExtractor. Channel i of the view is channel channel_ids[i] of the
+    parent (so channel_ids can also reorder channels), and frame 0 of the
+    view is frame start_frame of the parent.
+
+    No data is copied: reads are forwarded to the parent with translated
+    channels and frames, so the view returns views whenever the parent
+    does. A SubInputExtractor of a SubInputExtractor is flattened into a
+    single mapping onto the underlying extractor.
+
+    Parameters
+    ----------
+    parent_extractor: InputExtractor
+        The extractor to take the subset from
+    channel_ids: array_like
+        The parent channels to keep, in order (default: all)
+    start_frame: int
+        The first parent frame of the view (default 0)
+    end_frame: int
+        The parent frame at which the view ends (default: the end)
+    '''
+    def __init__(self, parent_extractor, *, channel_ids=None, start_frame=None, end_frame=None):
+        InputExtractor.__init__(self)
+        if start_frame is None:
+            start_frame=0
+        if end_frame is None:
+            end_frame=parent_extractor.getNumFrames()
+        if channel_ids is None:
+            channel_ids=range(parent_extractor.getNumChannels())
+        channel_ids=np.asarray(channel_ids,dtype=int)
+        if (start_frame<0) or (end_frame>parent_extractor.getNumFrames()) or (start_frame>end_frame):
+            raise Exception('Invalid frame range for sub extractor: [{}, {})'.format(start_frame,end_frame))
+        if np.any(channel_ids<0) or np.any(channel_ids>=parent_extractor.getNumChannels()):
+            raise Exception('Invalid channel ids for sub extractor')
+        if isinstance(parent_extractor,SubInputExtractor):
+            # compose with the parent's mapping so nested views cost nothing
+            channel_ids=parent_extractor._channel_map[channel_ids]
+            start_frame+=parent_extractor._start_frame
+            end_frame+=parent_extractor._start_frame
+            parent_extractor=parent_extractor._parent_extractor
+        self._parent_extractor=parent_extractor
+        self._channel_map=channel_ids
+        self._start_frame=int(start_frame)
+        self._end_frame=int(end_frame)
+
+    def getNumChannels(self):
+        return len(self._channel_map)
+
+    def getNumFrames(self):
+        return self._end_frame-self._start_frame
+
+    def getSamplingFrequency(self):
+        return self._parent_extractor.getSamplingFrequency()
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        # clamped to the view, so reads never reach outside it
+        start_frame=0 if start_frame is None else min(max(int(start_frame),0),self.getNumFrames())
+        end_frame=self.getNumFrames() if end_frame is None else min(max(int(end_frame),start_frame),self.getNumFrames())
+        if channel_ids is None:
+            parent_channel_ids=self._channel_map
+        else:
+            parent_channel_ids=self._channel_map[np.asarray(channel_ids,dtype=int)]
+        return self._parent_extractor.getRawTraces(
+            start_frame=self._start_frame+start_frame,
+            end_frame=self._start_frame+end_frame,
+            channel_ids=parent_channel_ids
+        )
+
+    def getChannelInfo(self, channel_id):
+        return self._parent_extractor.getChannelInfo(int(self._channel_map[channel_id]))
+
+    def getFileIdentity(self):
+        parent_identity=self._parent_extractor.getFileIdentity()
+        if parent_identity is None:
+            return None
+        return '{} channels={} frames={}-{}'.format(parent_identity,self._channel_map.tolist(),self._start_frame,self._end_frame)
+
+    def parentExtractor(self):
+        return self._parent_extractor
+
+    def parentChannelIds(self):
+        return self._channel_map.copy()
+
+    def parentFrameRange(self):
+        return (self._start_frame,self._end_frame)
@@ -0,0 +1,167 @@
+from .tools import get_cache_directory
+from .waveforms import extract_unit_waveforms
+import os, json, hashlib
+import numpy as np
+
+class WaveformStore(object):
+    '''A persistent, growing store of spike waveforms of a sorting.
+
+    For every unit, the spikes are visited in a fixed random order
+    (determined by seed), and the store holds the snippets of a prefix of
+    that order: asking for more spikes extracts only the missing ones and
+    appends them, and asking for fewer reads only the first ones. Each
+    unit's snippets live in a flat binary file that is memory mapped, so
+    waveforms extracted once (by a widget or any analysis) are reused
+    without touching the raw data again.
+
+    The store directory is keyed by the file identities of the recording
+    and the sorting (getFileIdentity), the snippet length, the channels and
+    the seed, so it is invalidated when any of them changes.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The recording
+    output_extractor: OutputExtractor
+        The sorting
+    snippet_len: int
+        The length of each snippet in frames
+    channel_ids: array_like
+        The channels to store (default: all)
+    seed: int
+        The seed of the spike order
+    cache_directory: str
+        The directory holding the stores (default: the waveforms directory
+        of the spikeinterface cache, see tools.get_cache_directory)
+    '''
+    def __init__(self, input_extractor, output_extractor, *, snippet_len=100, channel_ids=None, seed=0, cache_directory=None):
+        recording_identity=input_extractor.getFileIdentity()
+        sorting_identity=output_extractor.getFileIdentity()
+        if (recording_identity is None) or (sorting_identity is None):
+            raise Exception('WaveformStore needs input and output extractors that implement getFileIdentity')
+        if channel_ids is None:
+            channel_ids=range(input_extractor.getNumChannels())
+        self._IX=input_extractor
+        self._OX=output_extractor
+        self._snippet_len=int(snippet_len)
+        self._channel_ids=[int(ch) for ch in channel_ids]
+        self._seed=int(seed)
+        key=dict(
+            recording=recording_identity,
+            sorting=sorting_identity,
+            snippet_len=self._snippet_len,
+            channel_ids=self._channel_ids,
+            seed=self._seed
+        )
+        if cache_directory is None:
+            cache_directory=get_cache_directory('waveforms')
+        self._directory=os.path.join(cache_directory,hashlib.sha1(json.dumps(key,sort_keys=True).encode()).hexdigest())
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+        self._info_path=os.path.join(self._directory,'info.json')
+        if os.path.exists(self._info_path):
+            with open(self._info_path) as f:
+                self._info=json.load(f)
+        else:
+            self._info=dict(key=key,dtype=None,counts={})
+        self._spike_trains=None
+
+    def getStoreDirectory(self):
+        return self._directory
+
+    def getNumStoredSpikes(self, unit_id):
+        return self._info['counts'].get(str(unit_id),0)
+
+    def getUnitWaveforms(self, unit_id, *, max_num=None):
+        '''Return the waveforms of (up to max_num of) the spikes of a unit as
+        a (num_channels x snippet_len x num_spikes) array, extracting and
+        storing any that are not stored yet.'''
+        return self.getWaveforms([unit_id],max_num=max_num)[0]
+
+    def getUnitSpikeFrames(self, unit_id, *, max_num=None):
+        '''Return the frames of the spikes whose waveforms getUnitWaveforms
+        returns, in the same order'''
+        return self._spikeOrder(unit_id)[:self._numWanted(unit_id,max_num)]
+
+    def getWaveforms(self, unit_ids, *, max_num=None):
+        '''Like getUnitWaveforms for several units. The missing snippets of
+        all units are extracted together, in one sweep over the recording.'''
+        self.addWaveforms(unit_ids,max_num=max_num)
+        return [self._load(unit_id,self._numWanted(unit_id,max_num)) for unit_id in unit_ids]
+
+    def addWaveforms(self, unit_ids, *, max_num=None):
+        '''Make sure the first max_num spikes (all if None) of each unit are
+        stored'''
+        missing=[]
+        for unit_id in unit_ids:
+            n1=self.getNumStoredSpikes(unit_id)
+            n2=self._numWanted(unit_id,max_num)
+            if n2>n1:
+                missing.append((unit_id,self._spikeOrder(unit_id)[n1:n2]))
+        if len(missing)==0:
+            return
+        offsets=np.concatenate(([0],np.cumsum([len(frames) for _,frames in missing]))).astype(np.int64)
+        waveforms=extract_unit_waveforms(
+            self._IX,np.concatenate([frames for _,frames in missing]),offsets,
+            snippet_len=self._snippet_len,channel_ids=self._channel_ids
+        )
+        if self._info['dtype'] is None:
+            self._info['dtype']=str(waveforms[0].dtype)
+        for (unit_id,_),W in zip(missing,waveforms):
+            self._append(unit_id,W)
+        self._writeInfo()
+
+    def clear(self):
+        '''Remove all stored waveforms'''
+        for name in os.listdir(self._directory):
+            os.remove(os.path.join(self._directory,name))
+        self._info=dict(key=self._info['key'],dtype=None,counts={})
+
+    def _numWanted(self, unit_id, max_num):
+        num_spikes=len(self._spikeOrder(unit_id))
+        if max_num is None:
+            return num_spikes
+        return min(int(max_num),num_spikes)
+
+    def _spikeOrder(self, unit_id):
+        # the unit's spike frames in the store's fixed random order
+        if self._spike_trains is None:
+            spike_frames,_,offsets=self._OX.getAllSpikeTrains()
+            self._spike_trains=dict(spike_frames=spike_frames,offsets=offsets,index={unit:k for k,unit in enumerate(self._OX.getUnitIds())},orders={})
+        st=self._spike_trains
+        if unit_id not in st['orders']:
+            k=st['index'][unit_id]
+            frames=np.asarray(st['spike_frames'][st['offsets'][k]:st['offsets'][k+1]]).astype(np.int64)
+            rng=np.random.RandomState([self._seed,k])
+            st['orders'][unit_id]=frames[rng.permutation(len(frames))]
+        return st['orders'][unit_id]
+
+    def _unitPath(self, unit_id):
+        return os.path.join(self._directory,'unit-{}.dat'.format(unit_id))
+
+    def _append(self, unit_id, W):
+        # stored as (num_spikes x num_channels x snippet_len), so appending
+        # spikes appends bytes
+        path=self._unitPath(unit_id)
+        n1=self.getNumStoredSpikes(unit_id)
+        with open(path,'ab') as f:
+            # drop anything written after the last recorded count
+            f.truncate(n1*self._snippetBytes())
+            f.write(np.ascontiguousarray(W.transpose((2,0,1)),dtype=self._info['dtype']).tobytes())
+        self._info['counts'][str(unit_id)]=n1+W.shape[2]
+
+    def _load(self, unit_id, num):
+        M=len(self._channel_ids)
+        if num==0:
+            return np.zeros((M,self._snippet_len,0),dtype=self._info['dtype'] or 'float32')
+        X=np.memmap(self._unitPath(unit_id),dtype=self._info['dtype'],mode='r',shape=(num,M,self._snippet_len))
+        return X.transpose((1,2,0))
+
+    def _snippetBytes(self):
+        return len(self._channel_ids)*self._snippet_len*np.dtype(self._info['dtype']).itemsize
+
+    def _writeInfo(self):
+        tmp_path=self._info_path+'.tmp{}'.format(os.getpid())
+        with open(tmp_path,'w') as f:
+            json.dump(self._info,f)
+        os.replace(tmp_path,self._info_path)
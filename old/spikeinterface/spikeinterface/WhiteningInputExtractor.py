@@ -0,0 +1,101 @@
+from .InputExtractor import InputExtractor
+import os, json, hashlib
+import numpy as np
+
+class WhiteningInputExtractor(InputExtractor):
+    '''An InputExtractor that spatially whitens another one lazily. The
+    whitening matrix W (ZCA, so each whitened channel stays centered on
+    its original channel) is estimated once from randomly sampled chunks
+    and can be persisted, and each read is a single matrix product:
+    W[channel_ids,:] @ (traces - mean).
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The extractor to whiten
+    num_chunks: int
+        The number of random chunks used to estimate the covariance
+    chunk_size: int
+        The number of frames in each chunk
+    epsilon: float
+        Regularization added to the covariance eigenvalues, relative to
+        their mean
+    whitening_file: str
+        An .npz file holding the whitening matrix. It is loaded if it was
+        estimated from the same recording (getFileIdentity) with the same
+        parameters; otherwise the matrix is estimated and saved there.
+        Recordings without an identity are always re-estimated.
+    seed: int
+        The seed for choosing the chunks
+    dtype: str
+        The data type of the whitened traces
+    '''
+    def __init__(self, input_extractor, *, num_chunks=20, chunk_size=10000, epsilon=1e-6, whitening_file=None, seed=0, dtype='float32'):
+        InputExtractor.__init__(self)
+        self._input_extractor=input_extractor
+        self._dtype=np.dtype(dtype)
+        identity=input_extractor.getFileIdentity()
+        key=json.dumps(dict(identity=identity,num_chunks=int(num_chunks),chunk_size=int(chunk_size),epsilon=float(epsilon),seed=int(seed)),sort_keys=True)
+        W=None
+        if (whitening_file is not None) and (identity is not None) and os.path.exists(whitening_file):
+            data=np.load(whitening_file)
+            if ('key' in data) and (str(data['key'])==key):
+                W=data['W']
+                mean=data['mean']
+        if W is None:
+            W,mean=self._estimate(num_chunks,chunk_size,epsilon,seed)
+            if whitening_file is not None:
+                np.savez(whitening_file,W=W,mean=mean,key=key)
+        self._W=W.astype(self._dtype)
+        self._mean=mean.astype(self._dtype)
+
+    def getNumChannels(self):
+        return self._input_extractor.getNumChannels()
+
+    def getNumFrames(self):
+        return self._input_extractor.getNumFrames()
+
+    def getSamplingFrequency(self):
+        return self._input_extractor.getSamplingFrequency()
+
+    def getChannelInfo(self, channel_id):
+        return self._input_extractor.getChannelInfo(channel_id)
+
+    def getFileIdentity(self):
+        input_identity=self._input_extractor.getFileIdentity()
+        if input_identity is None:
+            return None
+        W_hash=hashlib.sha1(self._W.tobytes()+self._mean.tobytes()).hexdigest()
+        return '{} whitening={}'.format(input_identity,W_hash)
+
+    def getWhiteningMatrix(self):
+        return self._W.copy()
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        if start_frame is None:
+            start_frame=0
+        if end_frame is None:
+            end_frame=self.getNumFrames()
+        # every output channel mixes all input channels
+        traces=np.asarray(self._input_extractor.getRawTraces(start_frame=start_frame,end_frame=end_frame),dtype=self._dtype)
+        traces=traces-self._mean[:,np.newaxis]
+        if channel_ids is None:
+            return self._W@traces
+        return self._W[np.asarray(channel_ids,dtype=int),:]@traces
+
+    def _estimate(self, num_chunks, chunk_size, epsilon, seed):
+        N=self.getNumFrames()
+        chunk_size=min(chunk_size,N)
+        rng=np.random.RandomState(seed)
+        starts=np.unique(rng.randint(0,N-chunk_size+1,size=num_chunks))
+        X=np.concatenate([
+            np.asarray(self._input_extractor.getRawTraces(start_frame=t,end_frame=t+chunk_size),dtype='float64')
+            for t in starts
+        ],axis=1)
+        mean=np.mean(X,axis=1)
+        X-=mean[:,np.newaxis]
+        C=X@X.T/X.shape[1]
+        S,U=np.linalg.eigh(C)
+        S=np.maximum(S,0)+epsilon*np.mean(S)
+        W=(U/np.sqrt(S))@U.T
+        return W,mean
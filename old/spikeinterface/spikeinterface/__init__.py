@@ -1,6 +1,14 @@
 from .InputExtractor import InputExtractor
 from .OutputExtractor import OutputExtractor
+from .CachedInputExtractor import CachedInputExtractor
+from .SubInputExtractor import SubInputExtractor
+from .FilterInputExtractor import FilterInputExtractor
+from .CommonReferenceInputExtractor import CommonReferenceInputExtractor
+from .WhiteningInputExtractor import WhiteningInputExtractor
+from .ConcatenatedInputExtractor import ConcatenatedInputExtractor, ConcatenatedOutputExtractor
+from .WaveformStore import WaveformStore
 
 from .extractors.mdaextractors import MdaInputExtractor, MdaOutputExtractor
 from .extractors.mearecextractors import MEArecInputExtractor, MEArecOutputExtractor
+from .extractors.compressedextractors import CompressedInputExtractor
 
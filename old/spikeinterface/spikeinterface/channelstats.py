@@ -0,0 +1,110 @@
+from .tools import get_cache_directory
+from concurrent.futures import ThreadPoolExecutor
+import os, json, hashlib
+import numpy as np
+
+def compute_channel_stats(input_extractor, *, num_chunks=20, chunk_size=10000, percentiles=(1,5,25,50,75,95,99), seed=0, num_workers=None, cache_directory=None):
+    '''Estimate per-channel statistics of a recording from chunks sampled
+    across its whole duration: the recording is split into num_chunks equal
+    segments and one chunk is read at a random position within each.
+
+    If the extractor has a file identity (InputExtractor.getFileIdentity),
+    the result is stored in a small json sidecar under cache_directory,
+    keyed by that identity and the parameters, and later calls with the
+    same data return it without reading any traces.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The recording
+    num_chunks: int
+        The number of chunks to sample
+    chunk_size: int
+        The number of frames in each chunk
+    percentiles: sequence of float
+        The percentiles (0-100) to compute
+    seed: int
+        The seed for the chunk positions
+    num_workers: int
+        The number of threads reading chunks (default: one per chunk, up
+        to the number of CPUs)
+    cache_directory: str
+        Where the sidecars are kept (default: the channel_stats directory
+        of the spikeinterface cache, see tools.get_cache_directory)
+
+    Returns
+    -------
+    stats: dict
+        mean, std, noise (median absolute deviation / 0.6745), min and max
+        as arrays of length num_channels, percentiles as a
+        (num_channels x num_percentiles) array, and percentile_levels. A
+        recording without any frames has NaN statistics.
+    '''
+    params=dict(
+        num_chunks=int(num_chunks),
+        chunk_size=int(chunk_size),
+        percentiles=[float(p) for p in percentiles],
+        seed=int(seed)
+    )
+    sidecar_path=None
+    identity=input_extractor.getFileIdentity()
+    if identity is not None:
+        if cache_directory is None:
+            cache_directory=get_cache_directory('channel_stats')
+        key=hashlib.sha1(json.dumps(dict(identity=identity,params=params),sort_keys=True).encode()).hexdigest()
+        sidecar_path=os.path.join(cache_directory,key+'.json')
+        if os.path.exists(sidecar_path):
+            with open(sidecar_path) as f:
+                return _stats_from_json(json.load(f))
+    stats=_compute(input_extractor,params,num_workers)
+    if sidecar_path is not None:
+        obj=dict(identity=identity,params=params,stats={k:np.asarray(v).tolist() for k,v in stats.items()})
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+        # written under a temporary name first, so readers never see a partial file
+        tmp_path=sidecar_path+'.tmp{}'.format(os.getpid())
+        with open(tmp_path,'w') as f:
+            json.dump(obj,f)
+        os.replace(tmp_path,sidecar_path)
+    return stats
+
+def _compute(input_extractor, params, num_workers):
+    N=input_extractor.getNumFrames()
+    chunk_size=min(params['chunk_size'],N)
+    num_chunks=min(params['num_chunks'],N//max(chunk_size,1))
+    if num_chunks==0:
+        return _empty_stats(input_extractor.getNumChannels(),params)
+    if num_workers is None:
+        num_workers=min(num_chunks,os.cpu_count() or 1)
+    rng=np.random.RandomState(params['seed'])
+    # one chunk at a random position within each of num_chunks equal segments
+    edges=np.linspace(0,N-chunk_size,num_chunks+1)
+    starts=(edges[:-1]+rng.rand(num_chunks)*(edges[1:]-edges[:-1])).astype(np.int64)
+    def read_chunk(t):
+        return np.asarray(input_extractor.getRawTraces(start_frame=int(t),end_frame=int(t)+chunk_size),dtype='float32')
+    with ThreadPoolExecutor(max_workers=max(1,num_workers)) as executor:
+        X=np.concatenate(list(executor.map(read_chunk,starts)),axis=1)
+    median=np.median(X,axis=1)
+    return dict(
+        mean=np.mean(X,axis=1,dtype='float64'),
+        std=np.std(X,axis=1,dtype='float64'),
+        noise=np.median(np.abs(X-median[:,np.newaxis]),axis=1)/0.6745,
+        min=np.min(X,axis=1),
+        max=np.max(X,axis=1),
+        percentiles=np.percentile(X,params['percentiles'],axis=1).T,
+        percentile_levels=np.array(params['percentiles'])
+    )
+
+def _empty_stats(num_channels, params):
+    return dict(
+        mean=np.full(num_channels,np.nan),
+        std=np.full(num_channels,np.nan),
+        noise=np.full(num_channels,np.nan),
+        min=np.full(num_channels,np.nan),
+        max=np.full(num_channels,np.nan),
+        percentiles=np.full((num_channels,len(params['percentiles'])),np.nan),
+        percentile_levels=np.array(params['percentiles'])
+    )
+
+def _stats_from_json(obj):
+    return {k:np.array(v) for k,v in obj['stats'].items()}
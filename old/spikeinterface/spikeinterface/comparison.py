@@ -0,0 +1,162 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+def compare_to_ground_truth(gt_output_extractor, tested_output_extractor, *, delta_frames=10, min_score=0.5, start_frame=None, end_frame=None, max_pairs_per_block=2**22):
+    '''Compare a sorting to ground truth.
+
+    The agreement between every ground-truth unit i and every tested unit j
+    is the number of matched spikes: spikes of i and j within delta_frames
+    of each other, paired one to one, so no spike is counted twice. It is
+    computed for all unit pairs at once, in one merged pass over the
+    time-sorted spikes of both sortings: the window of each ground-truth
+    spike is found with searchsorted in the tested sorting, the windows are
+    expanded into candidate pairs block by block, and for every unit pair
+    each ground-truth spike, in time order, takes the earliest tested spike
+    of its window that is still free. With windows of equal width this
+    greedy matching has the largest possible number of pairs. The matched
+    pairs are counted with np.bincount.
+
+    Ground-truth units are then assigned to tested units one to one,
+    maximizing the total agreement score tp/(n_gt+n_tested-tp) (Hungarian
+    algorithm); assignments scoring below min_score are dropped.
+
+    Parameters
+    ----------
+    gt_output_extractor: OutputExtractor
+        The ground truth
+    tested_output_extractor: OutputExtractor
+        The sorting to evaluate
+    delta_frames: int
+        The largest time difference (in frames) between matching spikes
+    min_score: float
+        The smallest agreement score of an assigned pair
+    start_frame: int
+        Only compare spikes from this frame on
+    end_frame: int
+        Only compare spikes before this frame
+    max_pairs_per_block: int
+        The number of candidate spike pairs handled at once
+
+    Returns
+    -------
+    comparison: dict
+        gt_unit_ids, tested_unit_ids, agreement (num_gt_units x
+        num_tested_units matched spike counts) and scores; for each
+        ground-truth unit: best_match (the assigned tested unit id, or None),
+        num_gt_spikes, num_tested_spikes (of the assigned unit), tp, fp, fn,
+        accuracy, precision and recall; and unmatched_tested_unit_ids
+    '''
+    gt_unit_ids,gt_times,gt_labels,gt_counts=_merged_spikes(gt_output_extractor,start_frame,end_frame)
+    tested_unit_ids,tested_times,tested_labels,tested_counts=_merged_spikes(tested_output_extractor,start_frame,end_frame)
+    U1=len(gt_unit_ids)
+    U2=len(tested_unit_ids)
+
+    agreement=_match_spikes(gt_times,gt_labels,U1,tested_times,tested_labels,U2,delta_frames,max_pairs_per_block)
+    union=gt_counts[:,np.newaxis]+tested_counts[np.newaxis,:]-agreement
+    scores=np.where(union>0,agreement/np.maximum(union,1),0.0)
+
+    best_match=[None]*U1
+    tp=np.zeros(U1,dtype=np.int64)
+    num_tested_spikes=np.zeros(U1,dtype=np.int64)
+    if (U1>0) and (U2>0):
+        rows,cols=linear_sum_assignment(-scores)
+        for i,j in zip(rows,cols):
+            if scores[i,j]>=min_score:
+                best_match[i]=tested_unit_ids[j]
+                tp[i]=agreement[i,j]
+                num_tested_spikes[i]=tested_counts[j]
+    fn=gt_counts-tp
+    fp=num_tested_spikes-tp
+    with np.errstate(invalid='ignore',divide='ignore'):
+        accuracy=np.where(tp+fn+fp>0,tp/(tp+fn+fp),0.0)
+        precision=np.where(tp+fp>0,tp/(tp+fp),0.0)
+        recall=np.where(tp+fn>0,tp/(tp+fn),0.0)
+    matched=set(unit for unit in best_match if unit is not None)
+    return dict(
+        gt_unit_ids=gt_unit_ids,
+        tested_unit_ids=tested_unit_ids,
+        agreement=agreement,
+        scores=scores,
+        best_match=best_match,
+        num_gt_spikes=gt_counts,
+        num_tested_spikes=num_tested_spikes,
+        tp=tp,
+        fp=fp,
+        fn=fn,
+        accuracy=accuracy,
+        precision=precision,
+        recall=recall,
+        unmatched_tested_unit_ids=[unit for unit in tested_unit_ids if unit not in matched]
+    )
+
+def _merged_spikes(output_extractor, start_frame, end_frame):
+    # all spikes sorted by time, with the position of their unit in unit_ids
+    unit_ids=output_extractor.getUnitIds()
+    spike_frames,_,offsets=output_extractor.getAllSpikeTrains(start_frame,end_frame)
+    counts=np.diff(offsets).astype(np.int64)
+    times=np.asarray(spike_frames).astype(np.int64)
+    labels=np.repeat(np.arange(len(unit_ids)),counts)
+    order=np.argsort(times,kind='stable')
+    return list(unit_ids),times[order],labels[order],counts
+
+def _match_spikes(times, labels, num_units, other_times, other_labels, num_other_units, delta, max_pairs_per_block):
+    # counts[i,j]: spikes of unit i paired one to one with spikes of other
+    # unit j within delta frames
+    counts=np.zeros(num_units*num_other_units,dtype=np.int64)
+    lo=np.searchsorted(other_times,times-delta,side='left')
+    hi=np.searchsorted(other_times,times+delta,side='right')
+    num_in_window=hi-lo
+    pair_starts=np.concatenate(([0],np.cumsum(num_in_window)))
+    block_bounds=np.searchsorted(pair_starts,np.arange(0,pair_starts[-1]+max_pairs_per_block,max_pairs_per_block),side='right')-1
+    block_bounds=np.unique(np.concatenate(([0],block_bounds,[len(times)])))
+    # other spikes already taken (key: other spike*num_units+unit) by earlier
+    # blocks
+    taken=np.zeros(0,dtype=np.int64)
+    for i1,i2 in zip(block_bounds[:-1],block_bounds[1:]):
+        n=num_in_window[i1:i2]
+        total=int(n.sum())
+        if total==0:
+            continue
+        spikes=np.repeat(np.arange(i1,i2),n)
+        others=np.repeat(lo[i1:i2],n)+np.arange(total)-np.repeat(np.cumsum(n)-n,n)
+        # a spike takes at most one spike of each other unit (agent), and a
+        # spike of the other sorting is taken at most once per unit (resource)
+        agents=spikes*num_other_units+other_labels[others]
+        resources=others*num_units+labels[spikes]
+        # only the latest taken spikes can still be in a window
+        taken=taken[taken//num_units>=lo[i1]]
+        keep=~_in_sorted(resources,taken)
+        # the candidates of each agent, earliest first (the pairs are already
+        # in time order, so the keys are almost sorted)
+        order=np.argsort(agents[keep],kind='stable')
+        agents=agents[keep][order]
+        resources=resources[keep][order]
+        matched=[np.zeros(0,dtype=np.int64)]
+        while len(agents)>0:
+            # each agent proposes its earliest free candidate, and is accepted
+            # if no earlier agent of the block still has that candidate: then
+            # the greedy pass would give it to this agent too
+            first=np.concatenate(([True],agents[1:]!=agents[:-1]))
+            by_resource=np.argsort(resources,kind='stable')
+            sorted_resources=resources[by_resource]
+            group_starts=np.flatnonzero(np.concatenate(([True],sorted_resources[1:]!=sorted_resources[:-1])))
+            earliest_agent=np.empty(len(agents),dtype=np.int64)
+            earliest_agent[by_resource]=np.repeat(agents[by_resource][group_starts],np.diff(np.concatenate((group_starts,[len(agents)]))))
+            accept=first&(agents==earliest_agent)
+            accepted_agents=agents[accept]
+            accepted_resources=np.sort(resources[accept])
+            matched.append(accepted_resources)
+            keep=~(_in_sorted(agents,accepted_agents)|_in_sorted(resources,accepted_resources))
+            agents=agents[keep]
+            resources=resources[keep]
+        matched=np.concatenate(matched)
+        taken=np.sort(np.concatenate((taken,matched)))
+        counts+=np.bincount((matched%num_units)*num_other_units+other_labels[matched//num_units],minlength=len(counts))
+    return counts.reshape(num_units,num_other_units)
+
+def _in_sorted(x, sorted_values):
+    # whether each element of x is in the sorted array sorted_values
+    if len(sorted_values)==0:
+        return np.zeros(len(x),dtype=bool)
+    i=np.minimum(np.searchsorted(sorted_values,x),len(sorted_values)-1)
+    return sorted_values[i]==x
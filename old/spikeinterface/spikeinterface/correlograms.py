@@ -0,0 +1,146 @@
+import multiprocessing
+import numpy as np
+
+def compute_correlograms(output_extractor, *, bin_size, window_size, unit_ids=None, pairs=None, start_frame=None, end_frame=None, num_workers=1, max_pairs_per_block=2**22):
+    '''Compute exact auto- and cross-correlograms of a sorting from the full
+    spike trains.
+
+    The spikes of all units are merged into one time-sorted train. The
+    spikes within window_size frames after each spike are found with
+    searchsorted, every such pair is turned into a (unit, unit, bin) index,
+    and the pairs are counted with a single np.bincount, block by block so
+    memory stays bounded. With num_workers>1 the blocks are distributed over
+    processes and the counts summed.
+
+    The correlogram of (a, b) is the histogram of t_b - t_a over all pairs of
+    distinct spikes, with bins (k*bin_size, (k+1)*bin_size] for positive
+    lags, mirrored for negative ones, and num_bins=2*floor(window_size/bin_size)
+    bins in total. A zero lag pair is counted once in the first positive bin
+    of one direction and once in the mirrored first negative bin of the
+    other, so the correlogram of (b, a) is always the mirror of (a, b).
+
+    Parameters
+    ----------
+    output_extractor: OutputExtractor
+        The sorting
+    bin_size: float
+        The bin size in frames
+    window_size: float
+        The largest lag in frames
+    unit_ids: array_like
+        The units to include (default: all)
+    pairs: list of (unit_id, unit_id)
+        If given, only these correlograms are computed. If all pairs are
+        autocorrelograms, spikes of different units are never compared.
+    start_frame: int
+        Only use spikes from this frame on
+    end_frame: int
+        Only use spikes before this frame
+    num_workers: int
+        The number of worker processes
+    max_pairs_per_block: int
+        The number of spike pairs handled at once
+
+    Returns
+    -------
+    correlograms: dict
+        bin_edges (in frames), and either unit_ids and a dense
+        (num_units x num_units x num_bins) counts array, or (when pairs is
+        given) pairs and a (num_pairs x num_bins) counts array
+    '''
+    all_unit_ids=output_extractor.getUnitIds()
+    unit_index={unit:k for k,unit in enumerate(all_unit_ids)}
+    if pairs is not None:
+        pairs=[(a,b) for a,b in pairs]
+        unit_ids=sorted(set(a for a,_ in pairs)|set(b for _,b in pairs),key=lambda unit:unit_index[unit])
+    elif unit_ids is None:
+        unit_ids=all_unit_ids
+    unit_ids=list(unit_ids)
+    U=len(unit_ids)
+    num_bins_half=int(window_size/bin_size)
+    num_bins=2*num_bins_half
+
+    spike_frames,_,offsets=output_extractor.getAllSpikeTrains(start_frame,end_frame)
+    times=[]
+    labels=[]
+    for i,unit in enumerate(unit_ids):
+        k=unit_index[unit]
+        times.append(np.asarray(spike_frames[offsets[k]:offsets[k+1]]).astype(np.int64))
+        labels.append(np.full(offsets[k+1]-offsets[k],i,dtype=np.int64))
+    times=np.concatenate(times) if times else np.zeros(0,dtype=np.int64)
+    labels=np.concatenate(labels) if labels else np.zeros(0,dtype=np.int64)
+
+    autos_only=(pairs is not None) and all(a==b for a,b in pairs)
+    if autos_only and len(times)>0:
+        # shift each unit to its own time range, so windows never span two units
+        span=int(times.max()-times.min())+int(np.ceil(window_size))+1
+        keys=times-times.min()+labels*span
+    else:
+        keys=times
+    order=np.argsort(keys,kind='stable')
+    keys=keys[order]
+    labels=labels[order]
+
+    # the spikes of each window, j in (i, hi[i]), come after spike i
+    hi=np.searchsorted(keys,keys+num_bins_half*bin_size,side='right')
+    num_after=hi-np.arange(len(keys))-1
+    pair_starts=np.concatenate(([0],np.cumsum(num_after)))
+    block_bounds=np.unique(np.searchsorted(pair_starts,np.arange(0,pair_starts[-1]+max_pairs_per_block,max_pairs_per_block),side='right')-1)
+    block_bounds=np.unique(np.concatenate(([0],block_bounds,[len(keys)])))
+    blocks=list(zip(block_bounds[:-1],block_bounds[1:]))
+    # each worker counts a contiguous group of blocks
+    num_workers=max(1,min(int(num_workers),len(blocks)))
+    groups=np.linspace(0,len(blocks),num_workers+1).astype(int)
+    jobs=[
+        dict(keys=keys,labels=labels,num_after=num_after,blocks=blocks[g1:g2],num_units=U,bin_size=bin_size,num_bins_half=num_bins_half)
+        for g1,g2 in zip(groups[:-1],groups[1:])
+    ]
+    if num_workers>1:
+        with multiprocessing.Pool(num_workers) as pool:
+            partials=pool.map(_count_pairs,jobs)
+    else:
+        partials=[_count_pairs(job) for job in jobs]
+    counts=np.zeros(U*U*num_bins,dtype=np.int64)
+    for partial in partials:
+        counts+=partial
+    counts=counts.reshape(U,U,num_bins)
+    bin_edges=np.arange(-num_bins_half,num_bins_half+1)*bin_size
+    if pairs is not None:
+        index={unit:i for i,unit in enumerate(unit_ids)}
+        return dict(
+            pairs=pairs,
+            bin_edges=bin_edges,
+            correlograms=np.array([counts[index[a],index[b]] for a,b in pairs]).reshape(len(pairs),num_bins)
+        )
+    return dict(
+        unit_ids=unit_ids,
+        bin_edges=bin_edges,
+        correlograms=counts
+    )
+
+def _count_pairs(job):
+    keys=job['keys']
+    labels=job['labels']
+    U=job['num_units']
+    nbh=job['num_bins_half']
+    counts=np.zeros(U*U*2*nbh,dtype=np.int64)
+    for i1,i2 in job['blocks']:
+        num_after=job['num_after'][i1:i2]
+        total=int(num_after.sum())
+        if total==0:
+            continue
+        # expand the ragged windows into explicit (i, j) pairs
+        anchors=np.repeat(np.arange(i1,i2),num_after)
+        starts=np.cumsum(num_after)-num_after
+        j=anchors+1+np.arange(total)-np.repeat(starts,num_after)
+        lags=keys[j]-keys[anchors]
+        k=np.maximum(np.ceil(lags/job['bin_size']).astype(np.int64),1)-1
+        keep=k<nbh
+        a=labels[anchors][keep]
+        b=labels[j][keep]
+        k=k[keep]
+        # t_b - t_a = +lag for (a, b) and -lag for (b, a); zero lags go to
+        # the first positive bin for (a, b) and its mirror for (b, a)
+        counts+=np.bincount((a*U+b)*2*nbh+nbh+k,minlength=len(counts))
+        counts+=np.bincount((b*U+a)*2*nbh+nbh-1-k,minlength=len(counts))
+    return counts
@@ -0,0 +1 @@
+from .compressedextractors import CompressedInputExtractor
\ No newline at end of file
@@ -0,0 +1,260 @@
+'''
+On-disk layout of a compressed recording directory:
+
+    info.json       dimensions, sampling rate, chunk size, codec, channel
+                    groups, the per-channel gain/offset and the number of
+                    samples per channel clipped to the int16 range
+    index.npy       int64 array (num_chunks x num_groups+1) with the byte
+                    offset of each channel group's block within its chunk file
+    chunks/chunk-<c>.bin
+                    the compressed blocks of time chunk c, one per channel
+                    group, back to back
+
+Samples are stored as int16, x = gain*q + offset per channel. Each block is
+delta encoded along time (in wrapping int16 arithmetic, so it decodes
+exactly) and compressed with zlib or lzma. Every chunk file is written
+independently, so chunks can be written by parallel processes; info.json
+is written last.
+'''
+
+from spikeinterface import InputExtractor
+from spikeinterface.tools import channel_index, file_identity
+
+import os, json, warnings
+import zlib, lzma
+import multiprocessing
+import numpy as np
+from quantities import Quantity
+
+class CompressedInputExtractor(InputExtractor):
+    def __init__(self, *, recording_directory):
+        InputExtractor.__init__(self)
+        self._recording_directory=recording_directory
+        with open(os.path.join(recording_directory,'info.json')) as f:
+            self._info=json.load(f)
+        self._index=np.load(os.path.join(recording_directory,'index.npy'))
+        self._num_channels=self._info['num_channels']
+        self._num_frames=self._info['num_frames']
+        self._chunk_size=self._info['chunk_size']
+        self._gain=np.array(self._info['gain'],dtype='float32')
+        self._offset=np.array(self._info['offset'],dtype='float32')
+        self._channel_groups=[np.array(group,dtype=int) for group in self._info['channel_groups']]
+        # the group of each channel and its row within the group's blocks
+        self._channel_group=np.zeros(self._num_channels,dtype=int)
+        self._channel_row=np.zeros(self._num_channels,dtype=int)
+        for g,group in enumerate(self._channel_groups):
+            self._channel_group[group]=g
+            self._channel_row[group]=np.arange(len(group))
+        # int16 input with unit gain and zero offset is returned as is
+        self._scaled=not (np.all(self._gain==1) and np.all(self._offset==0))
+
+    def getNumChannels(self):
+        return self._num_channels
+
+    def getNumFrames(self):
+        return self._num_frames
+
+    def getSamplingFrequency(self):
+        return Quantity(self._info['samplerate'],'Hz')
+
+    def getChannelInfo(self, channel_id):
+        ret=dict(
+            group=int(self._channel_group[channel_id])
+        )
+        if self._info.get('channel_locations') is not None:
+            ret['location']=np.array(self._info['channel_locations'][channel_id])
+        return ret
+
+    def getFileIdentity(self):
+        # info.json is written last, so it changes whenever the store is rewritten
+        return file_identity(os.path.join(self._recording_directory,'info.json'))
+
+    def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
+        if start_frame is None:
+            start_frame=0
+        if end_frame is None:
+            end_frame=self.getNumFrames()
+        if channel_ids is None:
+            channel_ids=range(self.getNumChannels())
+        channel_ids=np.asarray(channel_ids,dtype=int)
+        cs=self._chunk_size
+        ret=np.empty((len(channel_ids),end_frame-start_frame),dtype='float32' if self._scaled else 'int16')
+        if end_frame<=start_frame:
+            return ret
+        groups=np.unique(self._channel_group[channel_ids])
+        for c in range(start_frame//cs,(end_frame-1)//cs+1):
+            t1=max(start_frame,c*cs)
+            t2=min(end_frame,(c+1)*cs)
+            with open(self._chunk_path(c),'rb') as f:
+                for g in groups:
+                    # decompress only the blocks of the groups we need
+                    block=self._read_block(f,c,g)
+                    inds=np.flatnonzero(self._channel_group[channel_ids]==g)
+                    rows=self._channel_row[channel_ids[inds]]
+                    ret[inds,t1-start_frame:t2-start_frame]=block[rows,t1-c*cs:t2-c*cs]
+        if self._scaled:
+            ret*=self._gain[channel_ids][:,np.newaxis]
+            ret+=self._offset[channel_ids][:,np.newaxis]
+        return ret
+
+    def _chunk_path(self, c):
+        return _chunk_path(self._recording_directory,c)
+
+    def _read_block(self, f, c, g):
+        i1=self._index[c,g]
+        i2=self._index[c,g+1]
+        f.seek(i1)
+        raw=_decompress(f.read(i2-i1),self._info['codec'])
+        num_frames=min(self._chunk_size,self._num_frames-c*self._chunk_size)
+        deltas=np.frombuffer(raw,dtype='int16').reshape(len(self._channel_groups[g]),num_frames)
+        return np.cumsum(deltas,axis=1,dtype='int16')
+
+    @staticmethod
+    def writeRecording(input_extractor, recording_directory, *, chunk_size=30000, channel_groups=None, group_size=32, codec='zlib', level=None, gain=None, offset=None, num_workers=1):
+        '''Write an InputExtractor to a compressed recording directory.
+
+        Parameters
+        ----------
+        input_extractor: InputExtractor
+            The recording to write
+        recording_directory: str
+            The output directory (created if needed)
+        chunk_size: int
+            The number of frames per time chunk
+        channel_groups: list of lists
+            The channels compressed together in one block (default: the
+            'group' of getChannelInfo if available, otherwise consecutive
+            runs of group_size channels)
+        codec: str
+            'zlib' or 'lzma'
+        level: int
+            The compression level (default: the codec's default)
+        gain, offset: array_like
+            Per-channel quantization, x = gain*q + offset with q an int16.
+            For int16 recordings the default is gain=1, offset=0 (lossless);
+            otherwise they are estimated from a sample of chunks so the
+            largest deviation seen uses about half of the int16 range.
+            Samples outside the int16 range are clipped; they are counted
+            per channel (num_clipped in info.json) and a warning is issued.
+        num_workers: int
+            The number of processes writing chunks in parallel
+        '''
+        if codec not in ('zlib','lzma'):
+            raise Exception('Unsupported codec: {}'.format(codec))
+        M=input_extractor.getNumChannels()
+        N=input_extractor.getNumFrames()
+        if channel_groups is None:
+            channel_groups=_default_channel_groups(input_extractor,group_size)
+        channel_groups=[[int(ch) for ch in group] for group in channel_groups]
+        if sorted(sum(channel_groups,[]))!=list(range(M)):
+            raise Exception('channel_groups must contain every channel exactly once')
+        if (gain is None) or (offset is None):
+            gain0,offset0=_estimate_gain_offset(input_extractor,chunk_size)
+            gain=gain0 if gain is None else gain
+            offset=offset0 if offset is None else offset
+        gain=np.broadcast_to(np.asarray(gain,dtype='float64'),(M,))
+        offset=np.broadcast_to(np.asarray(offset,dtype='float64'),(M,))
+
+        if not os.path.exists(os.path.join(recording_directory,'chunks')):
+            os.makedirs(os.path.join(recording_directory,'chunks'))
+        num_chunks=int(np.ceil(N/chunk_size))
+        jobs=[
+            (input_extractor,recording_directory,c,chunk_size,channel_groups,gain,offset,codec,level)
+            for c in range(num_chunks)
+        ]
+        if num_workers>1:
+            with multiprocessing.Pool(num_workers) as pool:
+                results=pool.map(_write_chunk,jobs,chunksize=1)
+        else:
+            results=[_write_chunk(job) for job in jobs]
+        block_sizes=[block_sizes for block_sizes,_ in results]
+        num_clipped=np.zeros(M,dtype=np.int64)
+        for _,chunk_num_clipped in results:
+            num_clipped+=chunk_num_clipped
+        if np.any(num_clipped>0):
+            warnings.warn('{} samples on {} channels exceeded the int16 range and were clipped (gain too small); see num_clipped in {}'.format(
+                int(num_clipped.sum()),int(np.count_nonzero(num_clipped)),os.path.join(recording_directory,'info.json')))
+        index=np.zeros((num_chunks,len(channel_groups)+1),dtype=np.int64)
+        if num_chunks>0:
+            index[:,1:]=np.cumsum(np.array(block_sizes,dtype=np.int64).reshape(num_chunks,len(channel_groups)),axis=1)
+        np.save(os.path.join(recording_directory,'index.npy'),index)
+
+        try:
+            channel_locations=[np.asarray(input_extractor.getChannelInfo(ch)['location']).tolist() for ch in range(M)]
+        except (NotImplementedError,KeyError):
+            channel_locations=None
+        info=dict(
+            num_channels=M,
+            num_frames=N,
+            samplerate=float(input_extractor.getSamplingFrequency().rescale('Hz').magnitude),
+            chunk_size=chunk_size,
+            codec=codec,
+            channel_groups=channel_groups,
+            gain=gain.tolist(),
+            offset=offset.tolist(),
+            num_clipped=num_clipped.tolist(),
+            channel_locations=channel_locations
+        )
+        with open(os.path.join(recording_directory,'info.json'),'w') as f:
+            json.dump(info,f)
+
+def _chunk_path(recording_directory, c):
+    return os.path.join(recording_directory,'chunks','chunk-{:08d}.bin'.format(c))
+
+def _default_channel_groups(input_extractor, group_size):
+    M=input_extractor.getNumChannels()
+    try:
+        groups=[input_extractor.getChannelInfo(ch).get('group',None) for ch in range(M)]
+    except NotImplementedError:
+        groups=[None]*M
+    if any(group is None for group in groups):
+        return [list(range(i,min(i+group_size,M))) for i in range(0,M,group_size)]
+    return [[ch for ch in range(M) if groups[ch]==group] for group in sorted(set(groups))]
+
+def _estimate_gain_offset(input_extractor, chunk_size, num_chunks=10):
+    M=input_extractor.getNumChannels()
+    N=input_extractor.getNumFrames()
+    dtype=np.asarray(input_extractor.getRawTraces(start_frame=0,end_frame=min(1,N))).dtype
+    if dtype==np.int16:
+        return np.ones(M),np.zeros(M)
+    starts=np.linspace(0,max(N-chunk_size,0),num_chunks).astype(int)
+    X=np.concatenate([
+        np.asarray(input_extractor.getRawTraces(start_frame=t,end_frame=min(t+chunk_size,N)),dtype='float64')
+        for t in np.unique(starts)
+    ],axis=1)
+    offset=np.median(X,axis=1)
+    max_dev=np.max(np.abs(X-offset[:,np.newaxis]),axis=1)
+    gain=np.where(max_dev>0,max_dev/16384,1)
+    return gain,offset
+
+def _write_chunk(job):
+    input_extractor,recording_directory,c,chunk_size,channel_groups,gain,offset,codec,level=job
+    t1=c*chunk_size
+    t2=min(t1+chunk_size,input_extractor.getNumFrames())
+    X=np.asarray(input_extractor.getRawTraces(start_frame=t1,end_frame=t2))
+    if X.dtype==np.int16 and np.all(gain==1) and np.all(offset==0):
+        Q=X
+        num_clipped=np.zeros(X.shape[0],dtype=np.int64)
+    else:
+        Q=np.round((X-offset[:,np.newaxis])/gain[:,np.newaxis])
+        num_clipped=np.count_nonzero((Q<-32768)|(Q>32767),axis=1)
+        Q=np.clip(Q,-32768,32767).astype('int16')
+    block_sizes=[]
+    with open(_chunk_path(recording_directory,c),'wb') as f:
+        for group in channel_groups:
+            block=Q[channel_index(group,Q.shape[0]),:]
+            deltas=np.diff(block,axis=1,prepend=np.zeros((block.shape[0],1),dtype='int16'))
+            data=_compress(np.ascontiguousarray(deltas,dtype='int16').tobytes(),codec,level)
+            f.write(data)
+            block_sizes.append(len(data))
+    return block_sizes,num_clipped
+
+def _compress(data, codec, level):
+    if codec=='zlib':
+        return zlib.compress(data,level if level is not None else 6)
+    return lzma.compress(data,preset=level)
+
+def _decompress(data, codec):
+    if codec=='zlib':
+        return zlib.decompress(data)
+    return lzma.decompress(data)
@@ -1,8 +1,10 @@
 from spikeinterface import InputExtractor
 from spikeinterface import OutputExtractor
 
+from spikeinterface.tools import channel_index, restrict_spike_trains, file_identity
+from . import mdaio
+
 from mountainlab_pytools import mlproc as mlp
-from mountainlab_pytools import mdaio
 import os, json
 import numpy as np
 from quantities import Quantity
@@ -23,11 +25,12 @@ class MdaInputExtractor(InputExtractor):
         geom0=dataset_directory+'/geom.csv'
         self._geom_fname=mlp.realizeFile(geom0)
         self._geom=np.genfromtxt(self._geom_fname, delimiter=',')
-        X=mdaio.DiskReadMda(self._timeseries_path)
+        X=_open_timeseries(self._timeseries_path)
         if self._geom.shape[0] != X.N1():
             raise Exception('Incompatible dimensions between geom.csv and timeseries file {} <> {}'.format(self._geom.shape[0],X.N1()))
         self._num_channels=X.N1()
         self._num_timepoints=X.N2()
+        self._X=X
         
     def getNumChannels(self):
         return self._num_channels
@@ -43,40 +46,134 @@ class MdaInputExtractor(InputExtractor):
             start_frame=0
         if end_frame is None:
             end_frame=self.getNumFrames()
-        if channel_ids is None:
-            channel_ids=range(self.getNumChannels())
-        X=mdaio.DiskReadMda(self._timeseries_path)
-        recordings=X.readChunk(i1=0,i2=t_start,N1=X.N1(),N2=t_end-t_start)
-        recordings=recordings[channel_ids,:]
-        return recordings
+        if isinstance(self._X,mdaio.DiskMda):
+            # A view into the memmap; only copies if the channels are not evenly spaced
+            return self._X.array()[channel_index(channel_ids,self._num_channels),start_frame:end_frame]
+        recordings=self._X.readChunk(i1=0,i2=start_frame,N1=self._num_channels,N2=end_frame-start_frame)
+        return recordings[channel_index(channel_ids,self._num_channels),:]
     
     def getChannelInfo(self, channel_id):
         return dict(
             location=self._geom[channel_id,:]
         )
 
+    def getFileIdentity(self):
+        return file_identity(self._timeseries_path)
+
+    @staticmethod
+    def writeDataset(input_extractor, save_path, *, dtype=None, chunk_size=None):
+        '''Write an InputExtractor as an mda dataset directory (raw.mda,
+        geom.csv, params.json). The traces are streamed chunk by chunk, so
+        memory use does not depend on the length of the recording.
+
+        Parameters
+        ----------
+        input_extractor: InputExtractor
+            The recording to write
+        save_path: str
+            The dataset directory (created if needed)
+        dtype: str
+            The data type of raw.mda (default: as returned by getRawTraces)
+        chunk_size: int
+            The number of frames written at once (default: ~64 MB worth)
+        '''
+        M=input_extractor.getNumChannels()
+        N=input_extractor.getNumFrames()
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        if dtype is None:
+            dtype=np.asarray(input_extractor.getRawTraces(start_frame=0,end_frame=min(1,N))).dtype
+        if chunk_size is None:
+            chunk_size=max(1,int(2**26/(M*np.dtype(dtype).itemsize)))
+        with mdaio.MdaWriter(save_path+'/raw.mda',dims=(M,N),dt=dtype) as W:
+            for traces,_,_ in input_extractor.iterChunks(chunk_size,dtype=dtype,reuse_buffer=True):
+                W.write(traces)
+        geom=np.zeros((M,2))
+        for m in range(M):
+            try:
+                geom[m,:]=np.asarray(input_extractor.getChannelInfo(m)['location'])[-2:]
+            except (NotImplementedError,KeyError):
+                geom[m,:]=[0,-m]
+        np.savetxt(save_path+'/geom.csv',geom,delimiter=',')
+        params=dict(
+            samplerate=float(input_extractor.getSamplingFrequency().rescale('Hz').magnitude)
+        )
+        with open(save_path+'/params.json','w') as f:
+            json.dump(params,f)
+
 class MdaOutputExtractor(OutputExtractor):
     def __init__(self, *, firings_file):
         OutputExtractor.__init__(self)
         print('Downloading file if needed: '+firings_file)
         self._firings_path=mlp.realizeFile(firings_file)
         print('Done.')
-        self._firings=mdaio.readmda(self._firings_path)
+        self._firings=_readmda(self._firings_path)
         self._times=self._firings[1,:]
         self._labels=self._firings[2,:]
         self._num_units=int(np.max(self._labels))
+        # Sorting by (label, time) makes the spikes of each unit a contiguous,
+        # time-sorted run of self._unit_times, starting at self._unit_offsets[unit_id]
+        order=np.lexsort((self._times,self._labels))
+        self._unit_times=self._times[order]
+        self._unit_offsets=np.searchsorted(self._labels[order],np.arange(1,self._num_units+2),side='left')
+        self._unit_labels=np.repeat(np.arange(self._num_units),np.diff(self._unit_offsets))
         
     def getNumUnits(self):
         return self._num_units
 
     def getUnitSpikeTrain(self, unit_id, start_frame=None, end_frame=None):
-        if start_frame is None:
-            start_frame=0
-        if end_frame is None:
-            end_frame=np.Inf
-        inds=np.where((self._labels==(unit_id+1))&(start_frame<=self._times)&(self._times<end_frame))
-        return self._times[inds]
+        times=self._unit_times[self._unit_offsets[unit_id]:self._unit_offsets[unit_id+1]]
+        i1=0
+        i2=len(times)
+        if start_frame is not None:
+            i1=np.searchsorted(times,start_frame,side='left')
+        if end_frame is not None:
+            i2=np.searchsorted(times,end_frame,side='left')
+        return times[i1:i2]
+
+    def getAllSpikeTrains(self, start_frame=None, end_frame=None):
+        i1=self._unit_offsets[0]
+        i2=self._unit_offsets[-1]
+        return restrict_spike_trains(self._unit_times[i1:i2],self._unit_labels,self._unit_offsets-i1,start_frame,end_frame)
+
+    def getFileIdentity(self):
+        return file_identity(self._firings_path)
+
+    @staticmethod
+    def writeFirings(output_extractor, firings_out):
+        '''Write the spike trains of an OutputExtractor as a firings.mda file
+        (3 x num_spikes: primary channel (0, unknown), spike frame, unit
+        label = unit index + 1), sorted by time.
+
+        Parameters
+        ----------
+        output_extractor: OutputExtractor
+            The sorting to write
+        firings_out: str
+            The output path
+        '''
+        spike_frames,spike_labels,offsets=output_extractor.getAllSpikeTrains()
+        # labels are the position of each unit in getUnitIds, counted from 1
+        unit_index=np.repeat(np.arange(len(offsets)-1),np.diff(offsets))
+        order=np.argsort(spike_frames,kind='stable')
+        firings=np.zeros((3,len(spike_frames)))
+        firings[1,:]=spike_frames[order]
+        firings[2,:]=unit_index[order]+1
+        mdaio.writemda(firings,firings_out,dt='float64')
     
+def _open_timeseries(path):
+    # Local files are memory-mapped natively; remote ones go through mountainlab
+    if mdaio.is_local_mda(path):
+        return mdaio.DiskMda(path)
+    from mountainlab_pytools import mdaio as ml_mdaio
+    return ml_mdaio.DiskReadMda(path)
+
+def _readmda(path):
+    if mdaio.is_local_mda(path):
+        return mdaio.readmda(path)
+    from mountainlab_pytools import mdaio as ml_mdaio
+    return ml_mdaio.readmda(path)
+
 def read_dataset_params(dsdir):
     params_fname=mlp.realizeFile(dsdir+'/params.json')
     if not os.path.exists(params_fname):
@@ -0,0 +1,240 @@
+'''
+Pure numpy reader/writer for the .mda file format used by MountainLab.
+
+An .mda file is a small binary header followed by the array data in
+column-major (Fortran) order. The header is:
+
+    int32   data type code (see _dt_codes below)
+    int32   number of bytes per entry
+    int32   number of dimensions (negative means the dims are int64)
+    dims    one int32 (or int64) per dimension
+
+Because the data is column-major, a 2D (num_channels x num_timepoints)
+array stores all channels of a timepoint contiguously, so any range of
+timepoints is a single contiguous block on disk.
+'''
+
+import os
+import struct
+import numpy as np
+
+_dt_codes={
+    'complex64':-1,
+    'uint8':-2,
+    'float32':-3,
+    'int16':-4,
+    'int32':-5,
+    'uint16':-6,
+    'float64':-7,
+    'uint32':-8
+}
+_dt_from_code={v:k for k,v in _dt_codes.items()}
+
+
+class MdaHeader:
+    def __init__(self, *, dt, dims, header_size):
+        self.dt=dt
+        self.dims=tuple(dims)
+        self.header_size=header_size
+
+    @property
+    def num_bytes_per_entry(self):
+        return np.dtype(self.dt).itemsize
+
+
+def readmda_header(path):
+    '''Parse the header of an .mda file without touching the data
+
+    Parameters
+    ----------
+    path: str
+        Path to a local .mda file
+
+    Returns
+    -------
+    header: MdaHeader
+        Data type, dimensions and header size (in bytes) of the file
+    '''
+    with open(path,'rb') as f:
+        return _read_header(f)
+
+
+def _read_header(f):
+    code,num_bytes,num_dims=struct.unpack('<iii',f.read(12))
+    if code not in _dt_from_code:
+        raise Exception('Invalid data type code in mda header: {}'.format(code))
+    dt=_dt_from_code[code]
+    if num_bytes!=np.dtype(dt).itemsize:
+        raise Exception('Unexpected number of bytes per entry in mda header: {}'.format(num_bytes))
+    dims_are_64bit=(num_dims<0)
+    num_dims=abs(num_dims)
+    if (num_dims<1) or (num_dims>50):
+        raise Exception('Invalid number of dimensions in mda header: {}'.format(num_dims))
+    if dims_are_64bit:
+        dims=struct.unpack('<{}q'.format(num_dims),f.read(8*num_dims))
+        header_size=12+8*num_dims
+    else:
+        dims=struct.unpack('<{}i'.format(num_dims),f.read(4*num_dims))
+        header_size=12+4*num_dims
+    return MdaHeader(dt=dt,dims=dims,header_size=header_size)
+
+
+def _header_bytes(dt, dims):
+    dt=np.dtype(dt).name
+    if dt not in _dt_codes:
+        raise Exception('Unsupported data type for mda file: {}'.format(dt))
+    dims=[int(d) for d in dims]
+    if max(dims,default=0)>=2**31:
+        return struct.pack('<iii',_dt_codes[dt],np.dtype(dt).itemsize,-len(dims))+struct.pack('<{}q'.format(len(dims)),*dims)
+    return struct.pack('<iii',_dt_codes[dt],np.dtype(dt).itemsize,len(dims))+struct.pack('<{}i'.format(len(dims)),*dims)
+
+
+class DiskMda:
+    '''A memory-mapped .mda file. The header is parsed once at construction
+    and the data is exposed as a read-only numpy.memmap, so reading a range
+    of the file never copies more than the caller asks for.
+
+    The memmap is created lazily and is not pickled, so a DiskMda can be
+    sent cheaply to worker processes.
+    '''
+    def __init__(self, path):
+        self._path=path
+        self._header=readmda_header(path)
+        self._memmap=None
+
+    def path(self):
+        return self._path
+
+    def dt(self):
+        return self._header.dt
+
+    def dims(self):
+        return self._header.dims
+
+    def N1(self):
+        return self._header.dims[0]
+
+    def N2(self):
+        return self._header.dims[1] if len(self._header.dims)>1 else 1
+
+    def array(self):
+        '''Return the whole file as a read-only, Fortran-ordered numpy.memmap'''
+        if self._memmap is None:
+            self._memmap=np.memmap(self._path,dtype=self._header.dt,mode='r',
+                offset=self._header.header_size,shape=self._header.dims,order='F')
+        return self._memmap
+
+    def readChunk(self, *, i1=0, i2=0, N1=None, N2=None):
+        '''Return a view of the 2D block starting at (i1,i2) of size (N1,N2)'''
+        if N1 is None:
+            N1=self.N1()-i1
+        if N2 is None:
+            N2=self.N2()-i2
+        return self.array()[i1:i1+N1,i2:i2+N2]
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state['_memmap']=None
+        return state
+
+
+def readmda(path):
+    '''Read an entire .mda file into memory
+
+    Parameters
+    ----------
+    path: str
+        Path to a local .mda file
+
+    Returns
+    -------
+    X: numpy.ndarray
+        The array stored in the file
+    '''
+    return np.array(DiskMda(path).array())
+
+
+class MdaWriter:
+    '''Write an .mda file in chunks along its last dimension, so arrays that
+    do not fit in memory can be streamed to disk. The header (with the final
+    dimensions) is written first and the data is appended in order.
+
+    Example
+    -------
+        with MdaWriter(path,dims=(M,N),dt='float32') as W:
+            for chunk in chunks:
+                W.write(chunk)
+    '''
+    def __init__(self, path, *, dims, dt='float32'):
+        self._path=path
+        self._dims=tuple(int(d) for d in dims)
+        self._dt=np.dtype(dt)
+        self._num_written=0
+        self._f=open(path,'wb')
+        self._f.write(_header_bytes(self._dt,self._dims))
+
+    def write(self, X):
+        '''Append X, whose leading dimensions must match the file's. The last
+        dimension of X may be any size.'''
+        X=np.asarray(X)
+        if X.ndim==len(self._dims)-1:
+            X=X.reshape(X.shape+(1,))
+        if tuple(X.shape[:-1])!=self._dims[:-1]:
+            raise Exception('Incompatible chunk shape for mda writer: {} <> {}'.format(X.shape,self._dims))
+        if self._num_written+X.shape[-1]>self._dims[-1]:
+            raise Exception('Too much data written to mda file: {}'.format(self._path))
+        # Fortran order on disk; transposing makes the memory layout match, so
+        # Fortran ordered chunks of the right type are written without a copy
+        self._f.write(memoryview(np.ascontiguousarray(X.T,dtype=self._dt)))
+        self._num_written+=X.shape[-1]
+
+    def close(self):
+        if self._f is None:
+            return
+        self._f.close()
+        self._f=None
+        if self._num_written!=self._dims[-1]:
+            raise Exception('Incomplete mda file {}: wrote {} of {} entries along the last dimension'.format(self._path,self._num_written,self._dims[-1]))
+
+    def abort(self):
+        '''Close the file without checking that it is complete'''
+        if self._f is not None:
+            self._f.close()
+            self._f=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            return
+        self.close()
+
+
+def writemda(X, path, *, dt=None, chunk_size=None):
+    '''Write an array to an .mda file
+
+    Parameters
+    ----------
+    X: array_like
+        The array to write. May be a numpy.memmap, in which case it is
+        written chunk by chunk along its last dimension.
+    path: str
+        Output path
+    dt: str
+        Data type to store (default: the dtype of X)
+    chunk_size: int
+        Number of entries along the last dimension to write at once
+    '''
+    if dt is None:
+        dt=X.dtype
+    if chunk_size is None:
+        chunk_size=max(1,int(2**26/max(1,np.prod(X.shape[:-1]))))
+    with MdaWriter(path,dims=X.shape,dt=dt) as W:
+        for i in range(0,X.shape[-1],chunk_size):
+            W.write(X[...,i:i+chunk_size])
+
+
+def is_local_mda(path):
+    return isinstance(path,str) and os.path.isfile(path)
@@ -1,86 +1,161 @@
 from spikeinterface import InputExtractor
 from spikeinterface import OutputExtractor
+from spikeinterface.tools import channel_index, restrict_spike_trains, file_identity
 
 import quantities as pq
 import numpy as np
-from os.path import join
+import weakref
+from os.path import join, abspath
 
 class MEArecInputExtractor(InputExtractor):
     def __init__(self, *, recording_folder):
         InputExtractor.__init__(self)
         self.recording_folder = recording_folder
-        self.fs = None
-        self.positions = None
-        self.recordings = None
-        
-    def _initialize(self):
-        recordings, times, positions, templates, spiketrains, sources, peaks, info = \
-            load_recordings(self.recording_folder)
-        self.fs  =info['General']['fs']
-        self.positions = positions
-        self.recordings = recordings
-        
+        self._folder = open_recording_folder(recording_folder)
+
     def getNumChannels(self):
-        if self.recordings is None:
-            self._initialize()
-        return self.recordings.shape[0]
-    
+        return self._folder.arrayShape('recordings')[0]
+
     def getNumFrames(self):
-        if self.recordings is None:
-            self._initialize()
-        return self.recordings.shape[1]
-    
+        return self._folder.arrayShape('recordings')[1]
+
     def getSamplingFrequency(self):
-        if self.fs is None:
-            self._initialize()
-        return self.fs * pq.kHz
-        
+        return self._folder.samplingFrequency()
+
     def getRawTraces(self, start_frame=None, end_frame=None, channel_ids=None):
-        if self.recordings is None:
-            self._initialize()
         if start_frame is None:
             start_frame=0
         if end_frame is None:
             end_frame=self.getNumFrames()
-        if channel_ids is None:
-            channel_ids=range(self.getNumChannels())
-        return recordings[channel_ids,:]
-    
+        recordings = self._folder.array('recordings')
+        return recordings[channel_index(channel_ids,self.getNumChannels()),start_frame:end_frame]
+
     def getChannelInfo(self, channel_id):
-        if self.positions is None:
-            self._initialize()
         return dict(
-            location=self.positions[channel_id,:]
+            location=self._folder.array('positions')[channel_id,:]
         )
 
+    def getFileIdentity(self):
+        return file_identity(self._folder._path('recordings'))
+
 class MEArecOutputExtractor(OutputExtractor):
     def __init__(self, *, recording_folder):
         OutputExtractor.__init__(self)
         self.recording_folder = recording_folder
-        self.numUnits = None
-        self.spike_trains = None
-        
-    def _initialize(self):
-        recordings, times, positions, templates, spiketrains, sources, peaks, info = \
-            load_recordings(self.recording_folder)
-        self.numUnits = len(spiketrains)
-        
+        self._folder = open_recording_folder(recording_folder)
+
     def getNumUnits(self):
-        if self.numUnits is None:
-            self._initialize()
-        return self.numUnits
+        return self._folder.arrayShape('spiketrains')[0]
 
     def getUnitSpikeTrain(self, unit_id, start_frame=None, end_frame=None):
-        if start_frame is None:
-            start_frame=0
-        if end_frame is None:
-            end_frame=np.Inf
-        if self.spike_trains is None:
-            self._initialize()
-        times=self.spike_trains[unit_id].times
-        inds=np.where((start_frame<=times)&(times<end_frame))
-        return times[inds]        
-        
+        spike_frames, _, offsets = self._folder.spikeFrames()
+        times = spike_frames[offsets[unit_id]:offsets[unit_id+1]]
+        i1 = 0
+        i2 = len(times)
+        if start_frame is not None:
+            i1 = np.searchsorted(times, start_frame, side='left')
+        if end_frame is not None:
+            i2 = np.searchsorted(times, end_frame, side='left')
+        return times[i1:i2]
+
+    def getAllSpikeTrains(self, start_frame=None, end_frame=None):
+        spike_frames, spike_labels, offsets = self._folder.spikeFrames()
+        return restrict_spike_trains(spike_frames, spike_labels, offsets, start_frame, end_frame)
+
+    def getFileIdentity(self):
+        return file_identity(self._folder._path('spiketrains'))
+
+class MEArecFolder(object):
+    '''Lazily loaded contents of a MEArec recordings folder. Nothing is read
+    at construction: info.yaml is parsed on first use, array shapes come
+    from the .npy headers alone, and the arrays themselves are
+    memory-mapped read-only when first requested.
+
+    Use open_recording_folder() to get the handle shared by all extractors
+    of the same folder.
+    '''
+    def __init__(self, recording_folder):
+        self.recording_folder = recording_folder
+        self._info = None
+        self._shapes = {}
+        self._arrays = {}
+        self._spike_frames = None
+
+    def info(self):
+        if self._info is None:
+            # PyYAML is only needed for MEArec folders
+            import yaml
+            with open(join(self.recording_folder, 'info.yaml'), 'r') as f:
+                self._info = yaml.safe_load(f)
+        return self._info
+
+    def samplingFrequency(self):
+        return self.info()['General']['fs'] * pq.kHz
+
+    def arrayShape(self, name):
+        '''Return the shape of <name>.npy, reading only the file header'''
+        if name in self._arrays:
+            return self._arrays[name].shape
+        if name not in self._shapes:
+            with open(self._path(name), 'rb') as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, _ = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, _ = np.lib.format.read_array_header_2_0(f)
+            self._shapes[name] = shape
+        return self._shapes[name]
+
+    def array(self, name):
+        '''Return the contents of <name>.npy, memory-mapped when possible'''
+        if name not in self._arrays:
+            try:
+                self._arrays[name] = np.load(self._path(name), mmap_mode='r')
+            except ValueError:
+                # object arrays (e.g. the neo spike trains) cannot be memory-mapped
+                self._arrays[name] = np.load(self._path(name), allow_pickle=True)
+        return self._arrays[name]
+
+    def spikeFrames(self):
+        '''Return the spike frames of all units, concatenated unit by unit
+        (time-sorted within each unit), together with the unit index of
+        every spike and the offsets where each unit's spikes start'''
+        if self._spike_frames is None:
+            fs = self.samplingFrequency().rescale('Hz').magnitude
+            spike_trains = []
+            for st in self.array('spiketrains'):
+                times = st.times if isinstance(st.times, pq.Quantity) else st.times * pq.s
+                # round, don't truncate: times*fs is not exactly integer
+                spike_trains.append(np.sort(np.round(times.rescale('s').magnitude * fs).astype(np.int64)))
+            counts = [len(spike_train) for spike_train in spike_trains]
+            offsets = np.zeros(len(spike_trains) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(counts)
+            spike_frames = np.concatenate(spike_trains) if spike_trains else np.zeros(0, dtype=np.int64)
+            spike_labels = np.repeat(np.arange(len(spike_trains)), counts)
+            self._spike_frames = (spike_frames, spike_labels, offsets)
+        return self._spike_frames
+
+    def __getstate__(self):
+        # don't pickle memory-mapped arrays; they are re-opened on demand
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    def _path(self, name):
+        return join(self.recording_folder, name + '.npy')
+
+_open_folders = weakref.WeakValueDictionary()
+
+def open_recording_folder(recording_folder):
+    '''Return the MEArecFolder handle for recording_folder, shared by every
+    extractor that currently has the folder open'''
+    key = abspath(recording_folder)
+    folder = _open_folders.get(key)
+    if folder is None:
+        folder = MEArecFolder(key)
+        _open_folders[key] = folder
+    return folder
+
 def load_recordings(recording_folder):
     '''
     Load generated recordings (from template_gen.py)
@@ -92,24 +167,22 @@ def load_recordings(recording_folder):
     Returns
     -------
     recordings, times, positions, templates, spiketrains, sources, peaks - np.arrays
+        The large arrays are read-only memory maps
     info - dict
 
     '''
-    print("Loading recordings...")
-
-    recordings = np.load(join(recording_folder, 'recordings.npy'))
-    positions = np.load(join(recording_folder, 'positions.npy'))
-    times = np.load(join(recording_folder, 'times.npy'))
-    templates = np.load(join(recording_folder, 'templates.npy'))
-    spiketrains = np.load(join(recording_folder, 'spiketrains.npy'))
-    sources = np.load(join(recording_folder, 'sources.npy'))
-    peaks = np.load(join(recording_folder, 'peaks.npy'))
+    folder = open_recording_folder(recording_folder)
 
-    with open(join(recording_folder, 'info.yaml'), 'r') as f:
-        info = yaml.load(f)
+    recordings = folder.array('recordings')
+    positions = folder.array('positions')
+    times = folder.array('times')
+    templates = folder.array('templates')
+    spiketrains = folder.array('spiketrains')
+    sources = folder.array('sources')
+    peaks = folder.array('peaks')
+    info = folder.info()
 
     if not isinstance(times, pq.Quantity):
         times = times * pq.ms
 
-    print("Done loading recordings...")
-    return recordings, times, positions, templates, spiketrains, sources, peaks, info
\ No newline at end of file
+    return recordings, times, positions, templates, spiketrains, sources, peaks, info
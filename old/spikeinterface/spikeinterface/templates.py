@@ -0,0 +1,188 @@
+from .waveforms import extract_unit_waveforms
+import multiprocessing
+import numpy as np
+
+def compute_templates(input_extractor, output_extractor, *, snippet_len=100, channel_ids=None, unit_ids=None, max_spikes_per_unit=None, median_sample_size=0, seed=0, chunk_size=None, num_workers=1):
+    '''Compute the templates of many units in a chunked pass over the
+    recording: the mean and standard deviation of each unit's snippets over
+    all (or a random sample of) its spikes, and optionally a median
+    template.
+
+    The spikes are processed in time order, chunk by chunk, and each chunk
+    updates running per-unit accumulators (count, mean and sum of squared
+    deviations, merged with Welford's/Chan's formulas), so memory does not
+    depend on the number of spikes. With num_workers>1 the spikes are split
+    into consecutive time ranges that are processed in separate processes,
+    and the partial accumulators are merged. The median is computed exactly
+    over a random sample of median_sample_size spikes per unit, whose
+    snippets are all kept in memory (median_sample_size x num_channels x
+    snippet_len values per unit), so it is only computed on request.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The recording
+    output_extractor: OutputExtractor
+        The sorting
+    snippet_len: int
+        The length of each snippet in frames (centered as in getRawSnippets)
+    channel_ids: array_like
+        The channels to include (default: all)
+    unit_ids: array_like
+        The units to compute templates for (default: all)
+    max_spikes_per_unit: int
+        If given, a random sample of at most this many spikes per unit is
+        used
+    median_sample_size: int
+        The number of spikes per unit the median template is computed from
+        (default 0: no median)
+    seed: int
+        The seed for the spike samples
+    chunk_size: int
+        The number of frames per chunk (default: ~16M samples)
+    num_workers: int
+        The number of worker processes
+
+    Returns
+    -------
+    templates: dict
+        unit_ids, num_spikes (per unit), and mean, std and median, each an
+        array of shape (num_units x num_channels x snippet_len); median is
+        None if median_sample_size is 0
+    '''
+    if channel_ids is None:
+        channel_ids=range(input_extractor.getNumChannels())
+    channel_ids=[int(ch) for ch in channel_ids]
+    if chunk_size is None:
+        chunk_size=2**24//max(len(channel_ids),1)
+    all_unit_ids=output_extractor.getUnitIds()
+    if unit_ids is None:
+        unit_ids=all_unit_ids
+    unit_ids=list(unit_ids)
+    unit_index={unit:k for k,unit in enumerate(all_unit_ids)}
+    spike_frames,_,offsets=output_extractor.getAllSpikeTrains()
+
+    # the spikes to use, with the unit (position in unit_ids) of each one and
+    # whether it is part of the median sample
+    frames=[]
+    labels=[]
+    in_median=[]
+    for i,unit in enumerate(unit_ids):
+        k=unit_index[unit]
+        st=np.asarray(spike_frames[offsets[k]:offsets[k+1]]).astype(np.int64)
+        order=np.random.RandomState([seed,k]).permutation(len(st))
+        if max_spikes_per_unit is not None:
+            order=order[:max_spikes_per_unit]
+        frames.append(st[order])
+        labels.append(np.full(len(order),i,dtype=np.int64))
+        flags=np.zeros(len(order),dtype=bool)
+        flags[:median_sample_size]=True
+        in_median.append(flags)
+    frames=np.concatenate(frames) if frames else np.zeros(0,dtype=np.int64)
+    labels=np.concatenate(labels) if labels else np.zeros(0,dtype=np.int64)
+    in_median=np.concatenate(in_median) if in_median else np.zeros(0,dtype=bool)
+    time_order=np.argsort(frames,kind='stable')
+    frames=frames[time_order]
+    labels=labels[time_order]
+    in_median=in_median[time_order]
+
+    # consecutive time ranges with about the same number of spikes
+    num_workers=max(1,min(int(num_workers),len(frames)))
+    bounds=np.linspace(0,len(frames),num_workers+1).astype(np.int64)
+    jobs=[
+        dict(
+            input_extractor=input_extractor,
+            frames=frames[i1:i2],
+            labels=labels[i1:i2],
+            in_median=in_median[i1:i2],
+            num_units=len(unit_ids),
+            snippet_len=snippet_len,
+            channel_ids=channel_ids,
+            chunk_size=chunk_size
+        )
+        for i1,i2 in zip(bounds[:-1],bounds[1:])
+    ]
+    if num_workers>1:
+        with multiprocessing.Pool(num_workers) as pool:
+            partials=pool.map(_accumulate,jobs)
+    else:
+        partials=[_accumulate(job) for job in jobs]
+    acc=_TemplateAccumulator(len(unit_ids),len(channel_ids),snippet_len)
+    for partial in partials:
+        acc.merge(partial)
+    return dict(
+        unit_ids=unit_ids,
+        num_spikes=acc.count.copy(),
+        mean=acc.mean.astype('float32'),
+        std=acc.std().astype('float32'),
+        median=acc.median().astype('float32') if median_sample_size>0 else None
+    )
+
+class _TemplateAccumulator(object):
+    # per-unit running count, mean and sum of squared deviations (M2), plus
+    # the snippets of the median sample
+    def __init__(self, num_units, num_channels, snippet_len):
+        self.count=np.zeros(num_units,dtype=np.int64)
+        self.mean=np.zeros((num_units,num_channels,snippet_len))
+        self.M2=np.zeros((num_units,num_channels,snippet_len))
+        self.median_samples=[[] for _ in range(num_units)]
+
+    def addBatch(self, snippets, labels, in_median):
+        # snippets: (num_channels x snippet_len x n), grouped by label
+        n=len(labels)
+        if n==0:
+            return
+        units,starts,counts=np.unique(labels,return_index=True,return_counts=True)
+        X=snippets.transpose((2,0,1)).astype('float64')
+        batch_mean=np.add.reduceat(X,starts,axis=0)/counts[:,np.newaxis,np.newaxis]
+        deviations=X-np.repeat(batch_mean,counts,axis=0)
+        batch_M2=np.add.reduceat(deviations*deviations,starts,axis=0)
+        self._combine(units,counts,batch_mean,batch_M2)
+        for i in np.flatnonzero(in_median):
+            self.median_samples[labels[i]].append(X[i].astype('float32'))
+
+    def merge(self, other):
+        units=np.flatnonzero(other.count)
+        self._combine(units,other.count[units],other.mean[units],other.M2[units])
+        for k in units:
+            self.median_samples[k].extend(other.median_samples[k])
+
+    def _combine(self, units, counts, means, M2s):
+        # Chan et al.: merge (count, mean, M2) of two sets of samples
+        na=self.count[units][:,np.newaxis,np.newaxis]
+        nb=counts[:,np.newaxis,np.newaxis]
+        n=na+nb
+        delta=means-self.mean[units]
+        self.mean[units]+=delta*(nb/n)
+        self.M2[units]+=M2s+delta*delta*(na*nb/n)
+        self.count[units]+=counts
+
+    def std(self):
+        ddof=np.maximum(self.count-1,1)[:,np.newaxis,np.newaxis]
+        return np.sqrt(self.M2/ddof)
+
+    def median(self):
+        ret=np.zeros(self.mean.shape)
+        for k,samples in enumerate(self.median_samples):
+            if len(samples)>0:
+                ret[k]=np.median(np.stack(samples),axis=0)
+        return ret
+
+def _accumulate(job):
+    frames=job['frames']
+    labels=job['labels']
+    in_median=job['in_median']
+    acc=_TemplateAccumulator(job['num_units'],len(job['channel_ids']),job['snippet_len'])
+    chunk_indices=frames//job['chunk_size']
+    bounds=np.concatenate(([0],np.flatnonzero(np.diff(chunk_indices))+1,[len(frames)]))
+    for i1,i2 in zip(bounds[:-1],bounds[1:]):
+        if i2<=i1:
+            continue
+        # group the chunk's spikes by unit, then read all their snippets at once
+        order=np.argsort(labels[i1:i2],kind='stable')+i1
+        snippets=extract_unit_waveforms(
+            job['input_extractor'],frames[order],[0,len(order)],
+            snippet_len=job['snippet_len'],channel_ids=job['channel_ids'],chunk_size=job['chunk_size']
+        )[0]
+        acc.addBatch(snippets,labels[order],in_median[order])
+    return acc
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+
+
+def channel_index(channel_ids, num_channels):
+    '''Convert a list of channel ids into something that can index the
+    channel axis of a (num_channels x num_frames) array. Evenly spaced,
+    increasing ids become a slice, so indexing returns a view; any other
+    selection becomes an integer array (and indexing makes a copy).
+
+    Parameters
+    ----------
+    channel_ids: array_like or None
+        The channel ids to select. None selects all channels.
+    num_channels: int
+        The number of channels of the array being indexed
+
+    Returns
+    -------
+    index: slice or numpy.ndarray
+        The index to apply to the channel axis
+    '''
+    if channel_ids is None:
+        return slice(0,num_channels)
+    channel_ids=np.asarray(channel_ids,dtype=int).ravel()
+    if len(channel_ids)==0:
+        return slice(0,0)
+    if (channel_ids.min()<-num_channels) or (channel_ids.max()>=num_channels):
+        # out of range: let the indexing raise
+        return channel_ids
+    # negative ids count from the end, as in numpy indexing
+    channel_ids=np.where(channel_ids<0,channel_ids+num_channels,channel_ids)
+    if len(channel_ids)==1:
+        return slice(int(channel_ids[0]),int(channel_ids[0])+1)
+    steps=np.diff(channel_ids)
+    if (steps[0]>0) and np.all(steps==steps[0]):
+        return slice(int(channel_ids[0]),int(channel_ids[-1])+1,int(steps[0]))
+    return channel_ids
+
+def restrict_spike_trains(spike_frames, spike_labels, offsets, start_frame=None, end_frame=None):
+    '''Restrict spike trains in the ragged (spike_frames, spike_labels,
+    offsets) representation of OutputExtractor.getAllSpikeTrains to the
+    frames [start_frame, end_frame), in a single pass over the spikes.
+    spike_labels must hold the position of each spike's unit in the offsets
+    array (0, 1, ...).
+    '''
+    if (start_frame is None) and (end_frame is None):
+        return spike_frames,spike_labels,offsets
+    keep=np.ones(len(spike_frames),dtype=bool)
+    if start_frame is not None:
+        keep&=(spike_frames>=start_frame)
+    if end_frame is not None:
+        keep&=(spike_frames<end_frame)
+    spike_labels=spike_labels[keep]
+    new_offsets=np.zeros(len(offsets),dtype=np.int64)
+    new_offsets[1:]=np.cumsum(np.bincount(spike_labels,minlength=len(offsets)-1))
+    return spike_frames[keep],spike_labels,new_offsets
+
+
+def file_identity(path):
+    '''Return a string identifying the current contents of a file: its
+    absolute path, size and modification time. Paths that are not local
+    files (e.g. kbucket:// or sha1:// addresses, which already name fixed
+    contents) are returned unchanged.
+    '''
+    if not os.path.isfile(path):
+        return str(path)
+    st=os.stat(path)
+    return '{}:{}:{}'.format(os.path.realpath(path),st.st_size,st.st_mtime_ns)
+
+
+def get_cache_directory(name):
+    '''Return (and create) a subdirectory of the spikeinterface cache
+    directory, which is $SPIKEINTERFACE_CACHE_DIR if set, otherwise
+    ~/.cache/spikeinterface.
+    '''
+    base=os.environ.get('SPIKEINTERFACE_CACHE_DIR',os.path.join(os.path.expanduser('~'),'.cache','spikeinterface'))
+    path=os.path.join(base,name)
+    os.makedirs(path,exist_ok=True)
+    return path
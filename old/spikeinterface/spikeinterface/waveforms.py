@@ -0,0 +1,87 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+def extract_unit_waveforms(input_extractor, spike_frames, offsets, *, snippet_len, channel_ids=None, chunk_size=None):
+    '''Extract the snippets of many units in one sequential sweep over the
+    recording.
+
+    The spikes are given in the ragged form of
+    OutputExtractor.getAllSpikeTrains: the spikes of unit k are
+    spike_frames[offsets[k]:offsets[k+1]] (typically a selection of each
+    unit's spikes). All snippets are sorted by frame and the recording is
+    read once, in order, in chunks of chunk_size frames; chunks without any
+    snippet are skipped. Each snippet is copied straight into its unit's
+    part of one preallocated buffer. Snippets follow the centering and zero
+    padding of InputExtractor.getRawSnippets.
+
+    Parameters
+    ----------
+    input_extractor: InputExtractor
+        The recording
+    spike_frames: array_like
+        The center frames of the snippets, grouped by unit
+    offsets: array_like
+        The start of each unit's spikes in spike_frames, followed by
+        len(spike_frames)
+    snippet_len: int
+        The length of each snippet in frames
+    channel_ids: array_like
+        The channels to extract (default: all)
+    chunk_size: int
+        The number of frames read at once (default: ~16M samples)
+
+    Returns
+    -------
+    waveforms: list of numpy.ndarray
+        One (num_channels x snippet_len x num_spikes) array per unit, each a
+        view into the shared buffer
+    '''
+    spike_frames=np.asarray(spike_frames).astype(np.int64).ravel()
+    offsets=np.asarray(offsets,dtype=np.int64)
+    if channel_ids is None:
+        channel_ids=range(input_extractor.getNumChannels())
+    if chunk_size is None:
+        chunk_size=2**24//max(len(channel_ids),1)
+    buffer=_gather_snippets(input_extractor,spike_frames,snippet_len,channel_ids,chunk_size)
+    return [buffer[:,:,offsets[k]:offsets[k+1]] for k in range(len(offsets)-1)]
+
+def _gather_snippets(input_extractor, center_frames, snippet_len, channel_ids, chunk_size, max_gap=None):
+    # (num_channels x snippet_len x num_snippets) snippets, in the order of
+    # center_frames. The snippets are sorted by frame and grouped into
+    # covering windows, each read once and gathered with a strided index; a
+    # new window starts at every chunk_size boundary, and (if max_gap is
+    # given) where consecutive snippets are more than max_gap frames apart.
+    snippet_len=int(snippet_len)
+    center_frames=np.asarray(center_frames).astype(np.int64).ravel()
+    num_channels=len(channel_ids)
+    num_snippets=len(center_frames)
+    chunk_size=max(int(chunk_size),snippet_len)
+    if num_snippets==0:
+        return np.zeros((num_channels,snippet_len,0))
+
+    # the snippet centered on frame c covers [c-offset, c-offset+snippet_len)
+    offset=int(np.floor((snippet_len+1)/2)-1)
+    starts=center_frames-offset
+    order=np.argsort(starts,kind='stable')
+    sorted_starts=starts[order]
+    breaks=np.diff(sorted_starts//chunk_size)!=0
+    if max_gap is not None:
+        breaks|=np.diff(sorted_starts)>max_gap
+    bounds=np.concatenate(([0],np.flatnonzero(breaks)+1,[num_snippets]))
+
+    buffer=None
+    for i1,i2 in zip(bounds[:-1],bounds[1:]):
+        w1=int(sorted_starts[i1])
+        w2=int(sorted_starts[i2-1])+snippet_len
+        window=input_extractor._getPaddedTraces(w1,w2,channel_ids)
+        if buffer is None:
+            buffer=np.zeros((num_channels,snippet_len,num_snippets),dtype=window.dtype)
+        # (num_channels x num_positions x snippet_len) view of every snippet in the window
+        all_snippets=as_strided(window,
+            shape=(num_channels,w2-w1-snippet_len+1,snippet_len),
+            strides=(window.strides[0],window.strides[1],window.strides[1]),
+            writeable=False
+        )
+        # order maps sorted snippets back to their original positions
+        buffer[:,:,order[i1:i2]]=all_snippets[:,sorted_starts[i1:i2]-w1,:].transpose((0,2,1))
+    return buffer
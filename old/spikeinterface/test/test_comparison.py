@@ -0,0 +1,73 @@
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_bipartite_matching
+from spikeinterface.OutputExtractor import OutputExtractor
+from spikeinterface.comparison import compare_to_ground_truth
+
+class _SpikeTrainsOutputExtractor(OutputExtractor):
+    def __init__(self, spike_trains):
+        OutputExtractor.__init__(self)
+        self._spike_trains=[np.asarray(st,dtype=np.int64) for st in spike_trains]
+
+    def getNumUnits(self):
+        return len(self._spike_trains)
+
+    def getUnitSpikeTrain(self, unit_id, start_frame=None, end_frame=None):
+        st=self._spike_trains[unit_id]
+        if start_frame is not None:
+            st=st[st>=start_frame]
+        if end_frame is not None:
+            st=st[st<end_frame]
+        return st
+
+def _brute_force_agreement(gt_train, tested_train, delta_frames):
+    # the largest one to one matching of spikes within delta_frames
+    candidates=csr_matrix(np.abs(gt_train[:,np.newaxis]-tested_train[np.newaxis,:])<=delta_frames)
+    return int(np.sum(maximum_bipartite_matching(candidates,perm_type='column')>=0))
+
+def test_spikes_are_matched_once():
+    # tested spike 10 is within reach of gt spikes 0 and 1, but can only be
+    # matched to one of them
+    R=compare_to_ground_truth(
+        _SpikeTrainsOutputExtractor([[0,1,30]]),
+        _SpikeTrainsOutputExtractor([[10,20,21]]),
+        delta_frames=10
+    )
+    assert R['agreement'][0,0]==2
+    assert R['tp'][0]==2
+    assert R['fn'][0]==1
+    assert R['fp'][0]==1
+
+def test_agreement_matches_brute_force():
+    rng=np.random.RandomState(0)
+    for trial in range(30):
+        gt=[np.sort(rng.randint(0,3000,rng.randint(0,80))) for _ in range(5)]
+        tested=[np.sort(rng.randint(0,3000,rng.randint(0,80))) for _ in range(4)]
+        delta_frames=rng.randint(1,40)
+        # small blocks, so that matches across block boundaries are exercised
+        R=compare_to_ground_truth(
+            _SpikeTrainsOutputExtractor(gt),
+            _SpikeTrainsOutputExtractor(tested),
+            delta_frames=delta_frames,
+            max_pairs_per_block=rng.randint(1,300)
+        )
+        for i in range(len(gt)):
+            for j in range(len(tested)):
+                assert R['agreement'][i,j]==_brute_force_agreement(gt[i],tested[j],delta_frames)
+
+def test_units_are_assigned():
+    rng=np.random.RandomState(1)
+    gt=[np.sort(rng.choice(10**6,300,replace=False)) for _ in range(6)]
+    # tested unit k detects 80% of the spikes of gt unit 5-k, with jitter
+    tested=[]
+    for k in range(6):
+        st=gt[5-k][rng.rand(300)<0.8]
+        tested.append(np.sort(st+rng.randint(-5,6,len(st))))
+    R=compare_to_ground_truth(_SpikeTrainsOutputExtractor(gt),_SpikeTrainsOutputExtractor(tested),delta_frames=10)
+    assert R['best_match']==[5,4,3,2,1,0]
+    assert np.array_equal(R['tp'],[len(st) for st in tested[::-1]])
+    assert np.all(R['fp']==0)
+    assert R['unmatched_tested_unit_ids']==[]
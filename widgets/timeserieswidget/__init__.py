@@ -1 +1,2 @@
-from .timeserieswidget import TimeseriesWidget
\ No newline at end of file
+from .timeserieswidget import TimeseriesWidget
+from .minmaxpyramid import MinMaxPyramid
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os, json
+import numpy as np
+
+class MinMaxPyramid:
+    '''Per-channel min/max decimation pyramid of a recording, for drawing
+    long time windows at a constant cost.
+
+    Level 0 holds the min and max of every bin of base_bin_size frames,
+    and each further level combines factor bins of the level below, down
+    to a single bin. The pyramid is built in one streaming pass over the
+    recording (iterChunks) and, if cache_directory is given, is stored
+    there as .npy files that are memory mapped when reopened. A stored
+    pyramid is only reused for the same recording, as given by its
+    getFileIdentity(); recordings without an identity are always rebuilt.
+
+    Windows whose bins would be finer than level 0 are computed from the
+    raw traces, which then are at most a few base bins per pixel. These
+    reads go through raw_reader if given (e.g. a CachedInputExtractor of
+    the same recording), while the build pass always reads input_extractor.
+    '''
+    def __init__(self,*,input_extractor,cache_directory=None,base_bin_size=256,factor=4,chunk_size=None,raw_reader=None):
+        self._IX=input_extractor
+        self._raw_reader=raw_reader if raw_reader is not None else input_extractor
+        self._cache_directory=cache_directory
+        self._base_bin_size=int(base_bin_size)
+        self._factor=int(factor)
+        self._chunk_size=chunk_size
+        self._mins=None
+        self._maxs=None
+    def numLevels(self):
+        self._initialize()
+        return len(self._mins)
+    def binSize(self,level):
+        return self._base_bin_size*self._factor**level
+    def getMinMax(self,*,start_frame,end_frame,num_pixels,channel_ids=None):
+        '''Return (bin_frames, mins, maxs) covering [start_frame, end_frame)
+        with about one bin per pixel (at least num_pixels bins).
+        bin_frames is the first frame of each bin; mins and maxs are
+        (channels x bins).'''
+        N=self._IX.getNumFrames()
+        start_frame=max(0,int(start_frame))
+        end_frame=min(N,int(end_frame))
+        if channel_ids is None:
+            channel_ids=range(self._IX.getNumChannels())
+        channel_ids=np.asarray(channel_ids,dtype=int)
+        frames_per_pixel=(end_frame-start_frame)/max(1,num_pixels)
+        if frames_per_pixel<self._base_bin_size:
+            bin_size=max(1,int(frames_per_pixel))
+            traces=self._raw_reader.getRawTraces(start_frame=start_frame,end_frame=end_frame,channel_ids=channel_ids)
+            mins,maxs=_bin_min_max(np.asarray(traces),bin_size)
+            return start_frame+np.arange(mins.shape[1])*bin_size,mins,maxs
+        self._initialize()
+        level=int(np.floor(np.log(frames_per_pixel/self._base_bin_size)/np.log(self._factor)))
+        level=min(level,len(self._mins)-1)
+        bin_size=self.binSize(level)
+        b1=start_frame//bin_size
+        b2=(end_frame-1)//bin_size+1
+        return np.arange(b1,b2)*bin_size,self._mins[level][channel_ids,b1:b2],self._maxs[level][channel_ids,b1:b2]
+    def _initialize(self):
+        if self._mins is not None:
+            return
+        if (self._cache_directory is not None) and self._load_cache():
+            return
+        self._build()
+    def _info(self):
+        return dict(
+            identity=self._IX.getFileIdentity(),
+            num_channels=self._IX.getNumChannels(),
+            num_frames=self._IX.getNumFrames(),
+            base_bin_size=self._base_bin_size,
+            factor=self._factor
+        )
+    def _level_shapes(self):
+        M=self._IX.getNumChannels()
+        num_bins=-(-self._IX.getNumFrames()//self._base_bin_size)
+        shapes=[(M,num_bins)]
+        while num_bins>1:
+            num_bins=-(-num_bins//self._factor)
+            shapes.append((M,num_bins))
+        return shapes
+    def _level_path(self,level,which):
+        return os.path.join(self._cache_directory,'level-{}-{}.npy'.format(level,which))
+    def _load_cache(self):
+        info_path=os.path.join(self._cache_directory,'info.json')
+        if not os.path.exists(info_path):
+            return False
+        with open(info_path) as f:
+            info=json.load(f)
+        expected=self._info()
+        if (expected['identity'] is None) or (info!=expected):
+            return False
+        num_levels=len(self._level_shapes())
+        self._mins=[np.load(self._level_path(k,'min'),mmap_mode='r') for k in range(num_levels)]
+        self._maxs=[np.load(self._level_path(k,'max'),mmap_mode='r') for k in range(num_levels)]
+        return True
+    def _build(self):
+        M=self._IX.getNumChannels()
+        B=self._base_bin_size
+        shapes=self._level_shapes()
+        chunk_size=self._chunk_size
+        if chunk_size is None:
+            chunk_size=2**24//(M*8)
+        # whole bins per chunk, so every chunk fills its own range of level 0
+        chunk_size=max(1,chunk_size//B)*B
+        dtype=np.asarray(self._IX.getRawTraces(start_frame=0,end_frame=1)).dtype
+        if (self._cache_directory is not None) and os.path.exists(os.path.join(self._cache_directory,'info.json')):
+            # a stale pyramid is being replaced
+            os.remove(os.path.join(self._cache_directory,'info.json'))
+        mins=[]
+        maxs=[]
+        for level,shape in enumerate(shapes):
+            mins.append(self._allocate(level,'min',shape,dtype))
+            maxs.append(self._allocate(level,'max',shape,dtype))
+        for traces,t1,t2 in self._IX.iterChunks(chunk_size,reuse_buffer=True):
+            chunk_mins,chunk_maxs=_bin_min_max(np.asarray(traces),B)
+            mins[0][:,t1//B:t1//B+chunk_mins.shape[1]]=chunk_mins
+            maxs[0][:,t1//B:t1//B+chunk_maxs.shape[1]]=chunk_maxs
+        # the coarser levels only read the level below
+        for level in range(1,len(shapes)):
+            step=self._factor*2**16
+            for b1 in range(0,shapes[level-1][1],step):
+                b2=min(b1+step,shapes[level-1][1])
+                lmins,_=_bin_min_max(np.asarray(mins[level-1][:,b1:b2]),self._factor)
+                _,lmaxs=_bin_min_max(np.asarray(maxs[level-1][:,b1:b2]),self._factor)
+                mins[level][:,b1//self._factor:b1//self._factor+lmins.shape[1]]=lmins
+                maxs[level][:,b1//self._factor:b1//self._factor+lmaxs.shape[1]]=lmaxs
+        if self._cache_directory is not None:
+            for level in range(len(shapes)):
+                mins[level].flush()
+                maxs[level].flush()
+            # info.json is written last, so an interrupted build is not reused
+            with open(os.path.join(self._cache_directory,'info.json'),'w') as f:
+                json.dump(self._info(),f)
+        self._mins=mins
+        self._maxs=maxs
+    def _allocate(self,level,which,shape,dtype):
+        if self._cache_directory is None:
+            return np.empty(shape,dtype=dtype)
+        if not os.path.exists(self._cache_directory):
+            os.makedirs(self._cache_directory)
+        return np.lib.format.open_memmap(self._level_path(level,which),mode='w+',dtype=dtype,shape=shape)
+
+def _bin_min_max(X,bin_size):
+    # min and max over consecutive bins along axis 1; the last bin may be partial
+    M,N=X.shape
+    num_full=N//bin_size
+    num_bins=-(-N//bin_size)
+    mins=np.empty((M,num_bins),dtype=X.dtype)
+    maxs=np.empty((M,num_bins),dtype=X.dtype)
+    if num_full>0:
+        Y=X[:,:num_full*bin_size].reshape(M,num_full,bin_size)
+        mins[:,:num_full]=Y.min(axis=2)
+        maxs[:,:num_full]=Y.max(axis=2)
+    if num_bins>num_full:
+        mins[:,num_full]=X[:,num_full*bin_size:].min(axis=1)
+        maxs[:,num_full]=X[:,num_full*bin_size:].max(axis=1)
+    return mins,maxs
@@ -1,11 +1,20 @@
 from matplotlib import pyplot as plt
 import numpy as np
 import ipywidgets as widgets
+from IPython.display import display
 from matplotlib.ticker import MaxNLocator
+from .minmaxpyramid import MinMaxPyramid
+from spikeinterface import CachedInputExtractor
+from concurrent.futures import ThreadPoolExecutor
 
 class TimeseriesWidget:
-    def __init__(self,*,input_extractor,output_extractor=None,channels=None,trange=None,width=14,height=7):
+    def __init__(self,*,input_extractor,output_extractor=None,channels=None,trange=None,width=14,height=7,pyramid_directory=None,num_pixels=None,cache_max_bytes=256*2**20):
         self._input_extractor=input_extractor
+        # raw reads go through a cache that a background thread fills ahead of panning
+        self._reader=CachedInputExtractor(input_extractor,max_bytes=cache_max_bytes)
+        self._prefetcher=ThreadPoolExecutor(max_workers=1)
+        self._prefetch_future=None
+        self._pan_direction=1
         self._output_extractor=output_extractor
         self._samplerate=input_extractor.getSamplingFrequency()
         self._width=width
@@ -14,49 +23,107 @@ class TimeseriesWidget:
         if self._visible_channels is None:
             self._visible_channels=range(input_extractor.getNumChannels())
         self._visible_trange=trange
+        # zoomed out views are drawn from min/max envelopes, about one per pixel column
+        self._pyramid=MinMaxPyramid(input_extractor=input_extractor,cache_directory=pyramid_directory,raw_reader=self._reader)
+        self._num_pixels=num_pixels
+        if self._num_pixels is None:
+            self._num_pixels=int(width*plt.rcParams['figure.dpi'])
         if self._visible_trange is None:
             self._visible_trange=[0,np.minimum(10000,input_extractor.getNumFrames())]
         self._initialize_stats()
-        self._vspacing=self._mean_channel_std*15
+        self._vspacing=self._mean_channel_noise*15
+        self._figure=None
+        self._canvas_displayed=False
+        self._plot_data=None
         self._widget=widgets.Output()
         self._control_panel=self._create_control_panel()
         self._main_widget=widgets.VBox([self._control_panel,self._widget])
         self._update_plot()
     def plot(self):
         self._do_plot()
+        display(self._figure)
     def display(self):
         display(self._main_widget)
     def widget(self):
         return self._widget
     def figure(self):
         return self._figure
-    def _update_plot(self):
-        self._widget.clear_output(wait=True)
-        with self._widget:
-            self._do_plot()
-    def _do_plot(self):
-        chunk0=self._input_extractor.getRawTraces(
-            channel_ids=self._visible_channels,
-            start_frame=self._visible_trange[0],
-            end_frame=self._visible_trange[1]
-        )
-        plt.xlim(self._visible_trange[0]/self._samplerate,self._visible_trange[1]/self._samplerate)
-        plt.ylim(-self._vspacing,self._vspacing*len(self._visible_channels))
-        plt.gcf().set_size_inches(self._width,self._height)
-        plt.gca().get_xaxis().set_major_locator(MaxNLocator(prune='both'))
-        plt.gca().get_yaxis().set_ticks([])
-        plt.xlabel('Time (sec)')
-
-        self._plots={}
-        self._plot_offsets={}
+    def _update_plot(self,reload=True):
+        self._do_plot(reload=reload)
+        if self._interactive:
+            # the canvas widget is displayed once and redraws in place
+            if not self._canvas_displayed:
+                with self._widget:
+                    display(self._figure.canvas)
+                self._canvas_displayed=True
+            self._figure.canvas.draw_idle()
+        else:
+            # static (inline) backends: the rendered figure is sent again
+            self._widget.clear_output(wait=True)
+            with self._widget:
+                display(self._figure)
+        self._prefetch_next()
+    def _do_plot(self,reload=True):
+        if self._figure is None:
+            self._create_figure()
+        if reload or (self._plot_data is None):
+            self._plot_data=self._get_plot_data()
+        tt,chunk0=self._plot_data
+        # only the data of the existing lines changes
         offset0=self._vspacing*(len(self._visible_channels)-1)
-        tt=np.arange(self._visible_trange[0],self._visible_trange[1])/self._samplerate
         for im,m in enumerate(self._visible_channels):
             self._plot_offsets[m]=offset0
-            self._plots[m]=plt.plot(tt,self._plot_offsets[m]+chunk0[im,:])
+            self._plots[m].set_data(tt,self._plot_offsets[m]+chunk0[im,:])
             offset0=offset0-self._vspacing
-        self._figure=plt.gcf()
-        plt.show()
+        self._axes.set_xlim(self._visible_trange[0]/self._samplerate,self._visible_trange[1]/self._samplerate)
+        self._axes.set_ylim(-self._vspacing,self._vspacing*len(self._visible_channels))
+    def _create_figure(self):
+        # not shown by pyplot; the widget displays it itself
+        with plt.ioff():
+            self._figure=plt.figure(figsize=(self._width,self._height))
+        self._axes=self._figure.gca()
+        self._axes.get_xaxis().set_major_locator(MaxNLocator(prune='both'))
+        self._axes.get_yaxis().set_ticks([])
+        self._axes.set_xlabel('Time (sec)')
+        self._plots={}
+        self._plot_offsets={}
+        for m in self._visible_channels:
+            self._plots[m]=self._axes.plot([],[])[0]
+        # e.g. ipympl, whose canvas is a widget that can be redrawn in place
+        self._interactive=isinstance(self._figure.canvas,widgets.DOMWidget)
+        if not self._interactive:
+            plt.close(self._figure)
+    def _prefetch_next(self):
+        t1,t2=self._visible_trange
+        span=t2-t1
+        if span/self._num_pixels>=self._pyramid.binSize(0):
+            # drawn from the pyramid, no raw reads to prefetch
+            return
+        if (self._prefetch_future is not None) and (not self._prefetch_future.done()):
+            self._prefetch_future.cancel()
+        if self._pan_direction>0:
+            self._prefetch_future=self._prefetcher.submit(self._reader.prefetch,t2,t2+span)
+        else:
+            self._prefetch_future=self._prefetcher.submit(self._reader.prefetch,t1-span,t1)
+    def _get_plot_data(self):
+        t1,t2=self._visible_trange
+        if t2-t1<=2*self._num_pixels:
+            chunk0=self._reader.getRawTraces(
+                channel_ids=self._visible_channels,
+                start_frame=t1,
+                end_frame=t2
+            )
+            return np.arange(t1,t2)/self._samplerate,chunk0
+        bin_frames,mins,maxs=self._pyramid.getMinMax(
+            start_frame=t1,
+            end_frame=t2,
+            num_pixels=self._num_pixels,
+            channel_ids=self._visible_channels
+        )
+        # a vertical stroke from min to max per bin
+        tt=np.repeat(bin_frames,2)/self._samplerate
+        chunk0=np.stack([mins,maxs],axis=2).reshape(mins.shape[0],-1)
+        return tt,chunk0
     def _pan_left(self):
         self._pan(-0.1)
     def _pan_right(self):
@@ -64,6 +131,7 @@ class TimeseriesWidget:
     def _pan(self,factor):
         span=self._visible_trange[1]-self._visible_trange[0]
         delta=int(span*factor)
+        self._pan_direction=1 if factor>0 else -1
         new_trange=[self._visible_trange[0]+delta,self._visible_trange[1]+delta]
         if new_trange[0]<0:
             new_trange[1]+=-new_trange[0]
@@ -76,7 +144,7 @@ class TimeseriesWidget:
         self._scale(1/1.2)
     def _scale(self,factor):
         self._vspacing/=factor
-        self._update_plot()
+        self._update_plot(reload=False)
     def _zoom_in(self):
         self._zoom(1.2)
     def _zoom_out(self):
@@ -92,25 +160,18 @@ class TimeseriesWidget:
         self._visible_trange=new_trange
         self._update_plot()
     def _initialize_stats(self):
+        # sampled across the whole recording (chunks read in parallel), and
+        # cached on disk for the file
+        stats=self._input_extractor.getChannelStats()
         self._channel_stats={}
-        #M=self._reader.numChannels()
-        #N=self._reader.numTimepoints()
-        chunk0=self._input_extractor.getRawTraces(
-            channel_ids=self._visible_channels,
-            start_frame=self._visible_trange[0],
-            end_frame=self._visible_trange[1]
-        )
-        #chunk0=self._reader.getChunk(channels=self._visible_channels,trange=self._visible_trange)
-        M0=chunk0.shape[0]
-        N0=chunk0.shape[1]
-        for ii in range(M0):
-            self._channel_stats[self._visible_channels[ii]]=self._compute_channel_stats_from_data(chunk0[ii,:])
-        self._mean_channel_std=np.mean([self._channel_stats[m]['std'] for m in self._visible_channels])
-    def _compute_channel_stats_from_data(self,X):
-        return dict(
-            mean=np.mean(X),
-            std=np.std(X)
-        )
+        for m in self._visible_channels:
+            self._channel_stats[m]=dict(
+                mean=stats['mean'][m],
+                std=stats['std'][m],
+                noise=stats['noise'][m]
+            )
+        # the median absolute deviation, unlike std, is not inflated by artifacts
+        self._mean_channel_noise=np.mean([self._channel_stats[m]['noise'] for m in self._visible_channels])
     def _create_control_panel(self):
         def on_zoom_in(b):
             self._zoom_in()
@@ -1,15 +1,25 @@
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import multiprocessing
 import numpy as np
 import ipywidgets as widgets
+from spikeinterface import WaveformStore
+from spikeinterface.waveforms import extract_unit_waveforms
+from spikeinterface.templates import compute_templates
 
 class UnitWaveformsWidget:
-    def __init__(self,*,input_extractor,output_extractor,channels=None,unit_ids=None,width=14,height=7):
+    def __init__(self,*,input_extractor,output_extractor,channels=None,unit_ids=None,width=14,height=7,num_workers=1,use_waveform_store=True,num_template_spikes=None):
         self._IX=input_extractor
         self._OX=output_extractor
         self._channels=channels
         self._unit_ids=unit_ids
         self._width=width
         self._height=height
+        self._num_workers=num_workers
+        self._use_waveform_store=use_waveform_store
+        self._num_template_spikes=num_template_spikes
         self._figure=None
     def plot(self):
         self._do_plot()
@@ -27,76 +37,53 @@ class UnitWaveformsWidget:
             channel_locations[ch,:]=loc[-2:]
         if channels is None:
             channels=range(M)
+        store=self._get_waveform_store(channels)
+        if store is not None:
+            # snippets of a random selection of spikes, extracted only once per recording and sorting
+            all_spikes=store.getWaveforms(units,max_num=50)
+        else:
+            # fetch the spike trains of all units in one call
+            spike_frames,_,offsets=self._OX.getAllSpikeTrains()
+            unit_index={unit:k for k,unit in enumerate(self._OX.getUnitIds())}
+            selected=[self._select_random_spikes(spike_train=spike_frames[offsets[unit_index[unit]]:offsets[unit_index[unit]+1]],max_num=50) for unit in units]
+            # the snippets of all units are read in one sweep over the recording
+            selected_offsets=np.concatenate(([0],np.cumsum([len(st) for st in selected]))).astype(np.int64)
+            selected_frames=np.concatenate(selected) if len(selected)>0 else np.zeros(0,dtype=np.int64)
+            all_spikes=extract_unit_waveforms(self._IX,selected_frames,selected_offsets,snippet_len=100,channel_ids=channels)
+        templates=None
+        if self._num_template_spikes is not None:
+            # averages over many more spikes than the representatives shown
+            templates=compute_templates(self._IX,self._OX,snippet_len=100,channel_ids=channels,unit_ids=units,max_spikes_per_unit=self._num_template_spikes,num_workers=self._num_workers)
         list=[]
-        for unit in units:
-            spikes=self._get_random_spike_waveforms(unit=unit,max_num=50,channels=channels)
+        for i,(unit,spikes) in enumerate(zip(units,all_spikes)):
             item=dict(
                 representative_waveforms=spikes,
                 title='Unit {}'.format(unit)
             )
+            if templates is not None:
+                item['average_waveform']=templates['mean'][i]
             list.append(item)
         with plt.rc_context({'axes.edgecolor':'gray'}):
             #self._plot_spike_shapes_multi(list,channel_locations=channel_locations[np.array(channels),:])
-            self._plot_spike_shapes_multi(list,channel_locations=None)
-    def _get_random_spike_waveforms(self,*,unit,max_num,channels):
-        st=self._OX.getUnitSpikeTrain(unit_id=unit)
+            self._plot_spike_shapes_multi(list,channel_locations=None,num_workers=self._num_workers)
+    def _get_waveform_store(self,channels):
+        if not self._use_waveform_store:
+            return None
+        if (self._IX.getFileIdentity() is None) or (self._OX.getFileIdentity() is None):
+            return None
+        return WaveformStore(self._IX,self._OX,snippet_len=100,channel_ids=channels)
+    def _select_random_spikes(self,*,spike_train,max_num):
+        st=np.asarray(spike_train)
         num_events=len(st)
         if num_events>max_num:
             event_indices=np.random.choice(range(num_events),size=max_num,replace=False)
         else:
             event_indices=range(num_events)
-        
-        spikes=self._IX.getRawSnippets(center_frames=st[event_indices].astype(int),snippet_len=100,channel_ids=channels)
-        spikes=np.dstack(tuple(spikes))
-        return spikes
-    def _plot_spike_shapes(self, *, representative_waveforms=None, average_waveform=None, channel_locations=None, ylim=None, max_representatives=None, color='blue',title=''):
-        if average_waveform is None:
-            if representative_waveforms is None:
-                raise Exception('You must provide either average_waveform, representative waveforms, or both')
-            average_waveform=np.mean(representative_waveforms,axis=2)
-        M=average_waveform.shape[0] # number of channels
-        T=average_waveform.shape[1] # number of timepoints
-        if ylim is None:
-            ylim=[average_waveform.min(),average_waveform.max()]
-        yrange=ylim[1]-ylim[0]
-        if channel_locations is None:
-            channel_locations=np.zeros((M,2))
-            for m in range(M):
-                channel_locations[m,:]=[0,-m]
-
-        spacing=1/0.8 # TODO: auto-determine this from the channel_locations
-
-        xvals=np.linspace(-yrange/2,yrange/2,T)
-        if representative_waveforms is not None:
-            if max_representatives is not None:
-                W0=representative_waveforms
-                if W0.shape[2]>max_representatives:
-                    indices=np.random.choice(range(W0.shape[2]),size=max_representatives,replace=False)
-                    representative_waveforms=W0[:,:,indices]
-            L=representative_waveforms.shape[2]
-            XX=np.zeros((T,M,L))
-            YY=np.zeros((T,M,L))
-            for m in range(M):
-                loc=channel_locations[m,-2:]*yrange*spacing
-                for j in range(L):
-                    XX[:,m,j]=loc[0]+xvals
-                    YY[:,m,j]=loc[1]+representative_waveforms[m,:,j]-representative_waveforms[m,0,j]
-            XX=XX.reshape(T,M*L)
-            YY=YY.reshape(T,M*L)
-            plt.plot(XX, YY, color=(0.5,0.5,0.5), alpha=0.4)
-
-            XX=np.zeros((T,M))
-            YY=np.zeros((T,M))
-            for m in range(M):
-                loc=channel_locations[m,-2:]*yrange*spacing
-                XX[:,m]=loc[0]+xvals
-                YY[:,m]=loc[1]+average_waveform[m,:]-average_waveform[m,0]
-            plt.plot(XX, YY, color)
-
-        plt.gca().get_xaxis().set_ticks([])
-        plt.gca().get_yaxis().set_ticks([])
-        if title:
-            plt.title(title,color='gray')
+        return st[event_indices].astype(np.int64)
+    def _plot_spike_shapes(self, *, representative_waveforms=None, average_waveform=None, channel_locations=None, ylim=None, max_representatives=None, color='blue',title='',ax=None):
+        if ax is None:
+            ax=plt.gca()
+        _draw_spike_shapes(ax,representative_waveforms=representative_waveforms,average_waveform=average_waveform,channel_locations=channel_locations,ylim=ylim,max_representatives=max_representatives,color=color,title=title)
     def _get_ylim_for_item(self,average_waveform=None,representative_waveforms=None):
         if average_waveform is None:
             if representative_waveforms is None:
@@ -115,13 +102,80 @@ class UnitWaveformsWidget:
             ret[1]=np.maximum(ylim0[1],ret[1])
         return ret
 
-    def _plot_spike_shapes_multi(self, list, *, ncols=5, **kwargs):
+    def _plot_spike_shapes_multi(self, list, *, ncols=5, num_workers=1, **kwargs):
         if 'ylim' in kwargs:
-            ylim=kwargs['ylim']
+            ylim=kwargs.pop('ylim')
         else:
             ylim=self._determine_global_ylim(list)
-        nrows = np.ceil(len(list) / ncols)
-        plt.figure(figsize=(3 * ncols, 3 * nrows))
+        nrows = int(np.ceil(len(list) / ncols))
+        self._figure=plt.figure(figsize=(3 * ncols, 3 * nrows))
+        if num_workers>1:
+            # render the units off screen in parallel, then show the images
+            jobs=[dict(item, **kwargs, ylim=ylim, size_inches=(3,3), dpi=self._figure.dpi) for item in list]
+            with multiprocessing.Pool(num_workers) as pool:
+                images=pool.map(_render_spike_shapes,jobs)
+            for i, image in enumerate(images):
+                ax=plt.subplot(nrows, ncols, i + 1)
+                ax.imshow(image)
+                ax.set_axis_off()
+            return
         for i, item in enumerate(list):
-            plt.subplot(nrows, ncols, i + 1)
-            self._plot_spike_shapes(**item, **kwargs, ylim=ylim)
\ No newline at end of file
+            ax=plt.subplot(nrows, ncols, i + 1)
+            self._plot_spike_shapes(**item, **kwargs, ylim=ylim, ax=ax)
+
+def _draw_spike_shapes(ax, *, representative_waveforms=None, average_waveform=None, channel_locations=None, ylim=None, max_representatives=None, color='blue', title=''):
+    if average_waveform is None:
+        if representative_waveforms is None:
+            raise Exception('You must provide either average_waveform, representative waveforms, or both')
+        average_waveform=np.mean(representative_waveforms,axis=2)
+    M=average_waveform.shape[0] # number of channels
+    T=average_waveform.shape[1] # number of timepoints
+    if ylim is None:
+        ylim=[average_waveform.min(),average_waveform.max()]
+    yrange=ylim[1]-ylim[0]
+    if channel_locations is None:
+        channel_locations=np.zeros((M,2))
+        channel_locations[:,1]=-np.arange(M)
+
+    spacing=1/0.8 # TODO: auto-determine this from the channel_locations
+
+    xvals=np.linspace(-yrange/2,yrange/2,T)
+    locs=np.asarray(channel_locations)[:,-2:]*yrange*spacing
+    if representative_waveforms is not None:
+        if max_representatives is not None:
+            W0=representative_waveforms
+            if W0.shape[2]>max_representatives:
+                indices=np.random.choice(range(W0.shape[2]),size=max_representatives,replace=False)
+                representative_waveforms=W0[:,:,indices]
+        # one segment per (channel, representative), built in a single broadcast
+        W=np.asarray(representative_waveforms)
+        segments=np.empty((M,W.shape[2],T,2))
+        segments[:,:,:,0]=locs[:,0,np.newaxis,np.newaxis]+xvals[np.newaxis,np.newaxis,:]
+        segments[:,:,:,1]=locs[:,1,np.newaxis,np.newaxis]+(W-W[:,0:1,:]).transpose((0,2,1))
+        segments=segments.reshape(-1,T,2)
+        # dense grids are rasterized when saved to vector formats
+        ax.add_collection(LineCollection(segments,colors=[(0.5,0.5,0.5)],alpha=0.4,rasterized=len(segments)>5000))
+
+    segments=np.empty((M,T,2))
+    segments[:,:,0]=locs[:,0,np.newaxis]+xvals[np.newaxis,:]
+    segments[:,:,1]=locs[:,1,np.newaxis]+average_waveform-average_waveform[:,0:1]
+    ax.add_collection(LineCollection(segments,colors=[color]))
+    ax.autoscale_view()
+
+    ax.get_xaxis().set_ticks([])
+    ax.get_yaxis().set_ticks([])
+    if title:
+        ax.set_title(title,color='gray')
+
+def _render_spike_shapes(job):
+    # runs in a worker process, without pyplot, on the Agg canvas
+    job=dict(job)
+    size_inches=job.pop('size_inches')
+    dpi=job.pop('dpi')
+    fig=Figure(figsize=size_inches,dpi=dpi)
+    canvas=FigureCanvasAgg(fig)
+    with plt.rc_context({'axes.edgecolor':'gray'}):
+        ax=fig.add_subplot(1,1,1)
+        _draw_spike_shapes(ax,**job)
+        canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()